@@ -4,7 +4,6 @@ import sys
 from enum import Enum
 
 from envparse import env
-from motor.motor_asyncio import AsyncIOMotorClient
 
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -22,10 +21,25 @@ MONGO_COLLECTION_INTEREST = env.str("MONGO_COLLECTION_INTEREST", default="pv-int
 MONGO_COLLECTION_DATA = env.str("MONGO_COLLECTION_DATA", default="pv-data")
 MONGO_COLLECTION_NACK = env.str("MONGO_COLLECTION_NACK", default="pv-nack")
 MONGO_COLLECTION_FRAGMENT = env.str("MONGO_COLLECTION_FRAGMENT", default="pv-fragment")
+MONGO_COLLECTION_ROLLUPS = env.str("MONGO_COLLECTION_ROLLUPS", default="pv-rollup")
+MONGO_COLLECTION_CHECKPOINTS = env.str("MONGO_COLLECTION_CHECKPOINTS", default="pv-checkpoint")
+PLOT_CACHE_DIR = env.str("PLOT_CACHE_DIR", default=os.path.join(ROOT_DIR, ".cache"))
+
 
 # DB
-DB_CLIENT = AsyncIOMotorClient(MONGO_HOST)
-DB = DB_CLIENT[MONGO_DB_NAME]
+# DB_CLIENT and DB are created on first access (settings.DB), so that importing the settings does
+# not load Motor. They are not part of `from settings import *`.
+def __getattr__(name):
+    if name == "DB_CLIENT":
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        globals()["DB_CLIENT"] = AsyncIOMotorClient(MONGO_HOST)
+        return globals()["DB_CLIENT"]
+    if name == "DB":
+        globals()["DB"] = __getattr__("DB_CLIENT")[MONGO_DB_NAME]
+        return globals()["DB"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 
 # LOG
 LOGGER = logging.getLogger("ANALYSER")
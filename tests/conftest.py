@@ -0,0 +1,24 @@
+import json
+
+import pytest
+
+
+@pytest.fixture
+def db():
+    # In-memory database with the Motor API
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    return mongomock_motor.AsyncMongoMockClient()["ndn-packet-view-test"]
+
+
+@pytest.fixture
+def write_packets(tmp_path):
+    # Writes the packets as an ndntdump output and returns its path
+    def write(packets, name="packets.ndjson"):
+        path = tmp_path / name
+        with open(path, "w") as file:
+            for packet in packets:
+                file.write(packet if isinstance(packet, str) else json.dumps(packet))
+                file.write("\n")
+        return str(path)
+
+    return write
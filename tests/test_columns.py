@@ -0,0 +1,32 @@
+import asyncio
+
+from tools.columns import MISSING, ColumnCache, scan
+
+DOCUMENTS = [
+    {"name": "/ndn/test", "ts": 1, "size2": 100},
+    {"ts": 2, "size2": 200},
+    {"name": "", "ts": 3},
+    {"name": "/ndn/test/ä", "ts": 4, "size2": 400},
+]
+
+
+async def read(db, cache=None):
+    batches = [batch async for batch in scan(db, "interest", ("name", "ts", "size2"), cache, 3)]
+    return {field: [v for batch in batches for v in batch[field].tolist()] for field in batches[0]}
+
+
+def test_cache_keeps_missing_names(db, tmp_path):
+    async def main():
+        await db["interest"].insert_many([dict(document) for document in DOCUMENTS])
+        cache = ColumnCache(tmp_path)
+        uncached = await read(db)
+        written = await read(db, cache)
+        path = await cache.path(db, "interest", ("name", "ts", "size2"))
+        assert (path / "meta.json").exists()
+        return uncached, written, await read(db, cache)
+
+    uncached, written, cached = asyncio.run(main())
+    assert uncached["name"] == ["/ndn/test", None, "", "/ndn/test/ä"]
+    assert uncached["size2"] == [100, 200, MISSING, 400]
+    assert written == uncached
+    assert cached == uncached
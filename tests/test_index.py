@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+from settings import MONGO_COLLECTION_CHECKPOINTS, MONGO_COLLECTION_INTEREST
+from tools.index import Indexer, input_source
+from tools.rollups import THROUGHPUT
+
+T0 = 1685595600 * 10**9
+
+
+def packet(t, i):
+    return {"t": t, "ts": T0 + i * 10**9, "size2": 100, "name": "/ndn/test"}
+
+
+async def index_until_error(indexer, path):
+    # Indexes until the invalid line, then lets the writes in flight complete like a crash would
+    with pytest.raises(ValueError):
+        await indexer.index_json(path)
+    await asyncio.gather(*indexer.pending_writes, return_exceptions=True)
+
+
+def test_checkpoint_advances_past_rare_packets(db, write_packets):
+    # A single nack at the start leaves its bulk partly filled for the whole input
+    packets = [packet("N", 0)] + [packet("I", i) for i in range(1, 4000)] + ["{invalid"]
+    path = write_packets(packets)
+    indexer = Indexer(db, batch_size=100, rollups=True)
+    asyncio.run(index_until_error(indexer, path))
+
+    async def read():
+        checkpoint = await db[MONGO_COLLECTION_CHECKPOINTS].find_one({"_id": input_source(path)[0]})
+        rows = await db[THROUGHPUT].find({}).to_list(None)
+        return checkpoint, rows
+
+    checkpoint, rows = asyncio.run(read())
+    assert checkpoint is not None
+    assert checkpoint["packets"] >= 4000 - (Indexer.MARK_LAG + 1) * 100
+    assert checkpoint["documents"][MONGO_COLLECTION_INTEREST] == checkpoint["packets"] - 1
+    assert len(indexer.marks) <= Indexer.MARK_LAG + 1
+    assert sum(row["packets"] for row in rows) == checkpoint["packets"]
+
+
+def test_rollups_without_checkpoints(db, write_packets):
+    path = write_packets([packet("ID"[i % 2], i) for i in range(1000)])
+    indexer = Indexer(db, batch_size=64, rollups=True, checkpoints=None)
+
+    async def run():
+        await indexer.index_json(path)
+        rows = await db[THROUGHPUT].find({}).to_list(None)
+        return rows, await db[MONGO_COLLECTION_CHECKPOINTS].count_documents({})
+
+    rows, checkpoints = asyncio.run(run())
+    assert sum(row["packets"] for row in rows) == 1000
+    assert checkpoints == 0
@@ -0,0 +1,42 @@
+import asyncio
+from datetime import datetime
+
+from settings import (
+    MONGO_COLLECTION_DATA,
+    MONGO_COLLECTION_FRAGMENT,
+    MONGO_COLLECTION_INTEREST,
+    MONGO_COLLECTION_NACK,
+)
+from tools.index import Indexer
+from tools.plots.throughput import PacketsHistogramThroughput
+
+COLLECTIONS = {
+    "INTEREST": MONGO_COLLECTION_INTEREST,
+    "DATA": MONGO_COLLECTION_DATA,
+    "NACK": MONGO_COLLECTION_NACK,
+    "FRAGMENT": MONGO_COLLECTION_FRAGMENT,
+}
+# 2023-06-01 05:00:00.000795, not on a whole minute
+T0 = 1685595600 * 10**9 + 795_000
+
+
+def test_throughput_reads_unaligned_rollups(db, write_packets):
+    packets = [
+        {"t": "ID"[i % 2], "ts": T0 + i * 7 * 10**9, "size2": 100, "name": "/ndn/test"}
+        for i in range(600)
+    ]
+    path = write_packets(packets)
+    plot = PacketsHistogramThroughput(db, COLLECTIONS)
+    plot.duration = 15
+
+    async def run():
+        await Indexer(db, rollups=True).index_json(path)
+        return await plot.from_rollups()
+
+    assert asyncio.run(run())
+    bins = plot.bins
+    assert bins.start_time == datetime(2023, 6, 1, 5, 0)
+    assert sum(bins.interest_packets) == 300
+    assert sum(bins.data_packets) == 300
+    # 15 minutes from the floored start, 7 seconds apart
+    assert bins.interest_packets[0] + bins.data_packets[0] == 900 // 7 + 1
@@ -0,0 +1,158 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+from tools.binning import ThroughputBinner, bin_raw_batch, num_bins, to_datetime
+from tools.columns import decode_columns
+
+START_TS = 1685595600 * 10**9
+
+
+def synthetic_trace(num_packets, hours, seed, chunk_size):
+    # Uniformly spread packets with Ethernet-like sizes, generated in chunks to bound memory
+    rng = np.random.default_rng(seed)
+    span = hours * 3600 * 10**9
+    for offset in range(0, num_packets, chunk_size):
+        n = min(chunk_size, num_packets - offset)
+        ts = START_TS + rng.integers(0, span, size=n, dtype=np.int64)
+        sizes = rng.integers(40, 8800, size=n, dtype=np.uint32)
+        yield ts, sizes
+
+
+def python_loop(ts, sizes, start_time, duration, num_durations):
+    # The per-packet loop the throughput scripts used before the NumPy engine
+    num_packets = [0] * num_durations
+    throughput = [0] * num_durations
+
+    def calculate_duration(packet_t):
+        packet_duration = int(
+            (datetime.utcfromtimestamp(packet_t / 1e9) - start_time).total_seconds()
+            // (duration * 60)
+        )
+        return min(packet_duration, num_durations - 1)
+
+    for packet_t, size in zip(ts, sizes):
+        packet_duration = calculate_duration(packet_t)
+        throughput[packet_duration] += size
+        num_packets[packet_duration] += 1
+    return num_packets, throughput
+
+
+def raw_batches(num_batches, batch_size, hours, seed):
+    # The documents of each batch as the RawBSONDocument list scan_raw reads from a cursor
+    import bson
+    from bson.raw_bson import RawBSONDocument
+
+    trace = synthetic_trace(num_batches * batch_size, hours, seed, batch_size)
+    return [
+        [
+            RawBSONDocument(bson.encode({"ts": bson.Int64(t), "size2": s}))
+            for t, s in zip(ts.tolist(), sizes.tolist())
+        ]
+        for ts, sizes in trace
+    ]
+
+
+def decode_benchmark(args, start_time, num_durations):
+    # Time per batch of each step of the client-side binning of packets read from the database
+    batches = raw_batches(args.decode_batches, args.batch_size, args.hours, args.seed)
+    decode_time = bin_time = join_time = 0.0
+    binner = ThroughputBinner(start_time, args.duration, num_durations)
+    for documents in batches:
+        begin = time.perf_counter()
+        data = b"".join(document.raw for document in documents)
+        join_time += time.perf_counter() - begin
+        begin = time.perf_counter()
+        batch = decode_columns(data, ("ts", "size2"))
+        decode_time += time.perf_counter() - begin
+        begin = time.perf_counter()
+        binner.add("INTEREST", batch["ts"], batch["size2"])
+        bin_time += time.perf_counter() - begin
+
+    data = [b"".join(document.raw for document in documents) for documents in batches]
+    empty = ThroughputBinner(start_time, args.duration, num_durations)
+    with ProcessPoolExecutor(args.workers) as pool:
+        # Start the workers before timing
+        list(pool.map(bin_raw_batch, [empty], ["INTEREST"], data[:1]))
+        begin = time.perf_counter()
+        pooled = ThroughputBinner(start_time, args.duration, num_durations)
+        for result in pool.map(bin_raw_batch, [empty] * len(data), ["INTEREST"] * len(data), data):
+            pooled.merge(result)
+        pool_time = time.perf_counter() - begin
+    assert pooled.packets["INTEREST"].tolist() == binner.packets["INTEREST"].tolist()
+
+    def per_batch(seconds):
+        return f"{seconds / len(batches) * 1000:8.1f} ms/batch"
+
+    print(f"batches:          {len(batches)} x {args.batch_size:,} documents")
+    print(f"bson decode:      {per_batch(decode_time)} (decode_all and to_columns)")
+    print(f"bincount:         {per_batch(bin_time)}")
+    print(f"raw handoff:      {per_batch(join_time)} (joined on the event loop for the workers)")
+    print(f"{args.workers} workers:        {per_batch(pool_time)} (decode and bin, wall time)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the NumPy throughput binning against the per-packet loop",
+        prog="python -m tools.benchmarks.binning",
+    )
+    parser.add_argument("--packets", default=50_000_000, type=int, help="Trace size")
+    parser.add_argument(
+        "--python-packets",
+        default=1_000_000,
+        type=int,
+        help="Packets timed with the per-packet loop, extrapolated to --packets",
+    )
+    parser.add_argument("--hours", default=3, type=int, help="Trace length in hours")
+    parser.add_argument("--duration", default=1, type=int, help="Bin size in minutes")
+    parser.add_argument("--chunk-size", default=5_000_000, type=int, help="Packets per chunk")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument(
+        "--decode-batches",
+        default=10,
+        type=int,
+        help="Raw BSON batches timed through decoding, binning and the worker processes "
+        "(0 skips it)",
+    )
+    parser.add_argument("--batch-size", default=100_000, type=int, help="Documents per batch")
+    parser.add_argument(
+        "--workers", default=os.cpu_count(), type=int, help="Processes decoding the raw batches"
+    )
+    args = parser.parse_args()
+
+    start_time = to_datetime(START_TS)
+    end_time = to_datetime(START_TS + args.hours * 3600 * 10**9)
+    num_durations = num_bins(start_time, end_time, args.duration)
+
+    # Baseline on a sample, checked against the NumPy engine on the same packets
+    ts, sizes = next(
+        synthetic_trace(args.python_packets, args.hours, args.seed, args.python_packets)
+    )
+    begin = time.perf_counter()
+    expected = python_loop(ts.tolist(), sizes.tolist(), start_time, args.duration, num_durations)
+    python_rate = args.python_packets / (time.perf_counter() - begin)
+
+    binner = ThroughputBinner(start_time, args.duration, num_durations)
+    binner.add("INTEREST", ts, sizes)
+    assert (binner.packets["INTEREST"].tolist(), binner.bytes.tolist()) == expected
+
+    binner = ThroughputBinner(start_time, args.duration, num_durations)
+    numpy_time = 0.0
+    for ts, sizes in synthetic_trace(args.packets, args.hours, args.seed, args.chunk_size):
+        begin = time.perf_counter()
+        binner.add("INTEREST", ts, sizes)
+        numpy_time += time.perf_counter() - begin
+    assert int(binner.packets["INTEREST"].sum()) == args.packets
+
+    python_time = args.packets / python_rate
+    print(f"packets:          {args.packets:,}")
+    print(f"per-packet loop:  {python_time:8.2f}s (extrapolated from {args.python_packets:,})")
+    print(f"numpy bincount:   {numpy_time:8.2f}s")
+    print(f"speedup:          {python_time / numpy_time:8.1f}x")
+
+    if args.decode_batches:
+        decode_benchmark(args, start_time, num_durations)
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import itertools
+import time
+
+from ndn.encoding import Name
+
+import settings
+from settings import MONGO_COLLECTION_DATA, MONGO_COLLECTION_INTEREST
+from tools.index import json_loads, open_input
+from tools.names import component_size, component_uri, name_length, name_uri
+
+# Names that exercise the escaping and typed component rules on top of the corpus
+EDGE_CASES = [
+    "",
+    "/",
+    "//",
+    "/a//",
+    "/ndn/edu/%C3%A9t%C3%A9",
+    "/ndn/Σπυρίδων/a b",
+    "/ndn/%41%42%zz",
+    "/ndn/seg=0/v=1700000000000/t=256/seq=65536",
+    "/ndn/32=keyword/8=generic/65535=max/65536=over/0=zero",
+    "/ndn/sha256digest=" + "ab" * 32,
+    "/ndn/params-sha256=" + "0F" * 32,
+    "/ndn/a=b=c",
+    "/ndn/" + "x" * 300,
+    "/ndn/" + "/".join(map(str, range(200))),
+]
+
+
+def file_names(file_path, limit):
+    with open_input(file_path) as stream:
+        names = (json_loads(line).get("name") for line in stream)
+        return list(itertools.islice(filter(None, names), limit))
+
+
+async def db_names(limit):
+    names = []
+    for collection in (MONGO_COLLECTION_INTEREST, MONGO_COLLECTION_DATA):
+        cursor = settings.DB[collection].find({"name": {"$exists": True}}, {"_id": 0, "name": 1})
+        names += [document["name"] async for document in cursor.limit(limit // 2)]
+    return names
+
+
+def result(function, name):
+    try:
+        return function(name)
+    except ValueError:
+        return ValueError
+
+
+def check(names):
+    mismatches = 0
+    for name in names:
+        expected = (
+            result(lambda n: len(Name.to_bytes(n)), name),
+            result(lambda n: Name.to_str(Name.from_str(n)), name),
+        )
+        if (result(name_length, name), result(name_uri, name)) != expected:
+            mismatches += 1
+            print(f"mismatch: {name!r}")
+    return mismatches
+
+
+def timed(function, names):
+    begin = time.perf_counter()
+    for name in names:
+        function(name)
+    return len(names) / (time.perf_counter() - begin)
+
+
+def clear_caches():
+    component_size.cache_clear()
+    component_uri.cache_clear()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the arithmetic name lengths against python-ndn and time both",
+        prog="python -m tools.benchmarks.names",
+    )
+    parser.add_argument(
+        "--file",
+        metavar="FILE",
+        help="Read the names from an ndntdump JSON output instead of the database",
+    )
+    parser.add_argument("--limit", default=1_000_000, type=int, help="Number of names")
+    args = parser.parse_args()
+
+    if args.file:
+        names = file_names(args.file, args.limit)
+    else:
+        names = asyncio.run(db_names(args.limit))
+    # Invalid names raise, which the timing loops do not expect
+    valid = [name for name in names if result(name_length, name) is not ValueError]
+
+    mismatches = check(EDGE_CASES + names)
+    print(f"names:            {len(names):,} ({len(names) - len(valid):,} invalid)")
+    print(f"mismatches:       {mismatches:,}")
+
+    ndn_rate = timed(lambda n: len(Name.to_bytes(n)), valid)
+    clear_caches()
+    cold_rate = timed(name_length, valid)
+    warm_rate = timed(name_length, valid)
+    print(f"Name.to_bytes:    {ndn_rate:12,.0f} names/s")
+    print(f"name_length cold: {cold_rate:12,.0f} names/s ({cold_rate / ndn_rate:.1f}x)")
+    print(f"name_length warm: {warm_rate:12,.0f} names/s ({warm_rate / ndn_rate:.1f}x)")
+
+    ndn_rate = timed(lambda n: Name.to_str(Name.from_str(n)), valid)
+    clear_caches()
+    uri_rate = timed(name_uri, valid)
+    print(f"Name.to_str:      {ndn_rate:12,.0f} names/s")
+    print(f"name_uri:         {uri_rate:12,.0f} names/s ({uri_rate / ndn_rate:.1f}x)")
+
+    if mismatches:
+        exit(1)
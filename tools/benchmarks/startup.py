@@ -0,0 +1,106 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ENTRY_POINTS = [
+    "tools.plots.all",
+    "tools.plots.batch",
+    "tools.plots.components_hexbin",
+    "tools.plots.content_size_distribution",
+    "tools.plots.grid_throughput",
+    "tools.plots.hoplimit",
+    "tools.plots.lifetime_freshness",
+    "tools.plots.popular_prefixes",
+    "tools.plots.throughput",
+]
+# Packages the entry points import on first use only: the database client and its bson, the
+# plotting stack and python-ndn
+LAZY_PACKAGES = [
+    "motor",
+    "pymongo",
+    "bson",
+    "matplotlib",
+    "seaborn",
+    "pandas",
+    "scipy",
+    "ndn",
+    "yaml",
+]
+
+# import time:       self [us] |  cumulative | imported package
+IMPORT_TIME = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def startup(module):
+    # Wall time of `python -m module --help` and the cumulative import time in microseconds of each
+    # module it imported, with -X importtime
+    begin = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", module, "--help"],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - begin
+    if result.returncode:
+        raise RuntimeError(f"{module} --help failed:\n{result.stderr}")
+    imports = {}
+    top_level = {}
+    for line in result.stderr.splitlines():
+        if match := IMPORT_TIME.match(line):
+            _, cumulative, indent, name = match.groups()
+            imports[name] = int(cumulative)
+            if not indent:
+                top_level[name] = int(cumulative)
+    return wall, imports, top_level
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the startup of the plotting scripts (--help) and check that the heavy "
+        "packages are only imported on first use",
+        prog="python -m tools.benchmarks.startup",
+    )
+    parser.add_argument(
+        "modules",
+        nargs="*",
+        default=ENTRY_POINTS,
+        help="Entry points to time (default: every plotting script)",
+    )
+    parser.add_argument(
+        "--repeat", default=5, type=int, help="Runs per entry point, the best counts"
+    )
+    parser.add_argument("--top", default=5, type=int, help="Slowest top-level imports shown")
+    parser.add_argument(
+        "--budget",
+        type=float,
+        metavar="MS",
+        help="Fail when the best startup of an entry point takes longer than MS milliseconds",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for module in args.modules:
+        runs = [startup(module) for _ in range(args.repeat)]
+        wall, imports, top_level = min(runs, key=lambda run: run[0])
+        print(f"{module}:")
+        print(f"  startup:  {wall * 1000:8.1f} ms (best of {args.repeat})")
+        print(f"  imports:  {sum(top_level.values()) / 1000:8.1f} ms ({len(imports)} modules)")
+        slowest = sorted(top_level.items(), key=lambda item: item[1], reverse=True)
+        for name, cumulative in slowest[: args.top]:
+            print(f"    {cumulative / 1000:8.1f} ms  {name}")
+
+        eager = sorted({name for name in imports if name.split(".")[0] in LAZY_PACKAGES})
+        if eager:
+            failed = True
+            print(f"  imported at startup: {', '.join(eager)}")
+        if args.budget is not None and wall * 1000 > args.budget:
+            failed = True
+            print(f"  over the budget of {args.budget:.0f} ms")
+    if failed:
+        exit(1)
@@ -0,0 +1,308 @@
+import asyncio
+import re
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from tools.columns import MISSING, decode_columns, scan, scan_raw
+
+EPOCH = datetime(1970, 1, 1)
+
+# The plots never show more than 3 hours
+MAX_MINUTES = 3 * 60
+
+
+@dataclass
+class ThroughputBins:
+    start_time: datetime
+    duration: int
+    interest_packets: list
+    data_packets: list
+    bytes: list
+
+    @property
+    def num_durations(self):
+        return len(self.bytes)
+
+    @property
+    def throughput(self):
+        # Mbps per bin
+        return [b * 8 / (self.duration * 60) / 1e6 for b in self.bytes]
+
+
+def to_datetime(ts):
+    return datetime.utcfromtimestamp(ts / 1e9)
+
+
+def to_microseconds(time):
+    return (time - EPOCH) // timedelta(microseconds=1)
+
+
+def parse_time(value):
+    # UTC time in nanoseconds from an ISO date or a duration before now such as 90m, 24h or 7d
+    if match := re.fullmatch(r"(\d+)([smhd])", value):
+        units = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+        time = datetime.utcnow() - timedelta(**{units[match[2]]: int(match[1])})
+    else:
+        time = datetime.fromisoformat(value)
+        if time.tzinfo is not None:
+            time = time.astimezone(timezone.utc).replace(tzinfo=None)
+    return to_microseconds(time) * 1000
+
+
+def ts_bounds(since=None, until=None):
+    # Query operators for since <= ts < until, served by the ts index
+    bounds = {}
+    if since is not None:
+        bounds["$gte"] = since
+    if until is not None:
+        bounds["$lt"] = until
+    return bounds
+
+
+def ts_mask(ts, since=None, until=None):
+    # ts_bounds applied to a ts column, which never matches the documents without a ts
+    mask = ts != MISSING
+    if since is not None:
+        mask &= ts >= since
+    if until is not None:
+        mask &= ts < until
+    return mask
+
+
+# Timestamp in microseconds, rounded the same way as datetime.utcfromtimestamp(ts / 1e9) so that
+# the server-side bins are exactly the ones the per-packet datetime arithmetic produced
+_TS_MICROSECONDS = {
+    "$let": {
+        "vars": {"s": {"$divide": ["$ts", 1e9]}},
+        "in": {
+            "$add": [
+                {"$multiply": [{"$floor": "$$s"}, 1000000]},
+                {"$round": [{"$multiply": [{"$subtract": ["$$s", {"$floor": "$$s"}]}, 1e6]}, 0]},
+            ]
+        },
+    }
+}
+
+
+def bin_pipeline(start_time, duration, num_durations):
+    bin_us = duration * 60 * 1000000
+    return [
+        {
+            "$group": {
+                "_id": {
+                    "$min": [
+                        {
+                            "$floor": {
+                                "$divide": [
+                                    {"$subtract": [_TS_MICROSECONDS, to_microseconds(start_time)]},
+                                    bin_us,
+                                ]
+                            }
+                        },
+                        num_durations - 1,
+                    ]
+                },
+                "packets": {"$sum": 1},
+                "bytes": {"$sum": "$size2"},
+            }
+        },
+    ]
+
+
+async def ts_bound(db, collection, direction, bounds=None):
+    document = await db[collection].find_one(
+        {"ts": {"$exists": True, **(bounds or {})}}, {"_id": 0, "ts": 1}, sort=[("ts", direction)]
+    )
+    return document["ts"] if document else None
+
+
+async def ts_range(db, collections, bounds=None):
+    # First and last timestamp of interests and data, served by the ts index
+    first = [await ts_bound(db, collections[c], 1, bounds) for c in ("INTEREST", "DATA")]
+    last = [await ts_bound(db, collections[c], -1, bounds) for c in ("INTEREST", "DATA")]
+    first = [ts for ts in first if ts is not None]
+    last = [ts for ts in last if ts is not None]
+    if not first:
+        raise ValueError("No interest or data packets found.")
+    return min(first), max(last)
+
+
+def num_bins(start_time, end_time, duration, max_minutes=MAX_MINUTES):
+    d = int((end_time - start_time).total_seconds())
+    if max_minutes is None:
+        return d // (duration * 60) + 1
+    return min(d // (duration * 60) + 1, max_minutes // duration)
+
+
+async def aggregate_bins(binner, db, name, collection, bounds=None):
+    # Adds the server-side bins of the packets within the ts bounds to the binner
+    pipeline = bin_pipeline(binner.start_time, binner.duration, binner.num_durations)
+    if bounds:
+        pipeline = [{"$match": {"ts": bounds}}, *pipeline]
+    async for row in db[collection].aggregate(pipeline):
+        # Negative indices wrap around like the list indexing of the per-packet loop for packets
+        # that precede the first interest or data packet
+        i = int(row["_id"])
+        binner.bytes[i] += row["bytes"]
+        if name in binner.packets:
+            binner.packets[name][i] += row["packets"]
+
+
+async def aggregate_throughput(db, collections, duration, since=None, until=None):
+    binner = await create_binner(db, collections, duration, since, until)
+    for name, collection in collections.items():
+        await aggregate_bins(binner, db, name, collection, ts_bounds(since, until))
+    return binner.result()
+
+
+def to_microseconds_array(ts):
+    # Vectorised to_microseconds(to_datetime(ts)) with the same rounding as datetime
+    seconds = ts / 1e9
+    whole = np.floor(seconds)
+    return whole.astype(np.int64) * 1000000 + np.round((seconds - whole) * 1e6).astype(np.int64)
+
+
+class ThroughputBinner:
+    def __init__(self, start_time, duration, num_durations):
+        self.start_time = start_time
+        self.duration = duration
+        self.num_durations = num_durations
+        self.start_us = to_microseconds(start_time)
+        self.bin_us = duration * 60 * 1000000
+        self.packets = {
+            "INTEREST": np.zeros(num_durations, dtype=np.int64),
+            "DATA": np.zeros(num_durations, dtype=np.int64),
+        }
+        self.bytes = np.zeros(num_durations, dtype=np.int64)
+
+    def bin_indices(self, ts):
+        indices = np.minimum(
+            (to_microseconds_array(ts) - self.start_us) // self.bin_us, self.num_durations - 1
+        )
+        # Same as list indexing in the per-packet loop for packets before the first bin
+        return np.where(indices < 0, indices + self.num_durations, indices)
+
+    def add(self, name, ts, sizes, counts=None):
+        # counts holds the number of packets behind each ts when they are already aggregated
+        indices = self.bin_indices(ts)
+        self.bytes += np.rint(
+            np.bincount(indices, weights=sizes, minlength=self.num_durations)
+        ).astype(np.int64)
+        if name in self.packets:
+            self.packets[name] += np.rint(
+                np.bincount(indices, weights=counts, minlength=self.num_durations)
+            ).astype(np.int64)
+
+    def bin_index(self, ts):
+        return (to_microseconds(to_datetime(ts)) - self.start_us) // self.bin_us
+
+    def extend(self, num_durations):
+        # Appends empty bins, used when following a collection that keeps growing
+        extra = num_durations - self.num_durations
+        if extra <= 0:
+            return
+        for name, packets in self.packets.items():
+            self.packets[name] = np.concatenate((packets, np.zeros(extra, dtype=np.int64)))
+        self.bytes = np.concatenate((self.bytes, np.zeros(extra, dtype=np.int64)))
+        self.num_durations = num_durations
+
+    def empty(self):
+        return ThroughputBinner(self.start_time, self.duration, self.num_durations)
+
+    def merge(self, other):
+        for name, packets in other.packets.items():
+            self.packets[name] += packets
+        self.bytes += other.bytes
+
+    def result(self):
+        return ThroughputBins(
+            self.start_time,
+            self.duration,
+            self.packets["INTEREST"].tolist(),
+            self.packets["DATA"].tolist(),
+            self.bytes.tolist(),
+        )
+
+
+def range_binner(first_ts, last_ts, duration, since=None, until=None, max_minutes=MAX_MINUTES):
+    if since is None and until is None:
+        start_time = to_datetime(first_ts)
+        num_durations = num_bins(start_time, to_datetime(last_ts), duration, max_minutes)
+    else:
+        # An explicit time range is shown whole instead of being limited to MAX_MINUTES
+        start_time = to_datetime(first_ts if since is None else since)
+        end_time = to_datetime(last_ts if until is None else until - 1)
+        num_durations = num_bins(start_time, end_time, duration, max_minutes=None)
+    return ThroughputBinner(start_time, duration, num_durations)
+
+
+async def create_binner(db, collections, duration, since=None, until=None):
+    first_ts, last_ts = await ts_range(db, collections, ts_bounds(since, until))
+    return range_binner(first_ts, last_ts, duration, since, until)
+
+
+def bin_raw_batch(binner, name, data):
+    # Runs in a worker process: decodes one raw batch and bins it into an empty binner that is
+    # merged by the caller
+    batch = decode_columns(data, ("ts", "size2"))
+    binner.add(name, batch["ts"], batch["size2"])
+    return binner
+
+
+async def scan_bins(binner, db, collections, cache=None, executor=None, bounds=None, max_pending=2):
+    # With an executor the batches are fetched as raw BSON, then decoded and binned in worker
+    # processes while the next ones are fetched. Cached columns are memory-mapped and binned here.
+    query = {"ts": bounds} if bounds else None
+    if executor is None or cache is not None:
+        for name, collection in collections.items():
+            async for batch in scan(db, collection, ("ts", "size2"), cache, query=query):
+                binner.add(name, batch["ts"], batch["size2"])
+        return
+    loop = asyncio.get_running_loop()
+    pending = deque()
+    for name, collection in collections.items():
+        async for data in scan_raw(db, collection, ("ts", "size2"), query=query):
+            if len(pending) >= max_pending:
+                binner.merge(await pending.popleft())
+            pending.append(
+                loop.run_in_executor(executor, bin_raw_batch, binner.empty(), name, data)
+            )
+    while pending:
+        binner.merge(await pending.popleft())
+
+
+async def numpy_throughput(
+    db, collections, duration, cache=None, executor=None, since=None, until=None
+):
+    binner = await create_binner(db, collections, duration, since, until)
+    await scan_bins(binner, db, collections, cache, executor, ts_bounds(since, until))
+    return binner.result()
+
+
+# 2-D count histogram of non-negative integer pairs that grows to fit the largest values seen, so
+# its size depends on the value range and not on the number of packets
+class CountGrid:
+    def __init__(self, shape=(32, 1024)):
+        self.counts = np.zeros(shape, dtype=np.int64)
+
+    def add(self, x, y):
+        if not len(x):
+            return
+        rows, cols = self.counts.shape
+        if x.max() >= rows or y.max() >= cols:
+            rows = max(rows, int(x.max()) + 1)
+            cols = max(cols, int(y.max()) + 1)
+            counts = np.zeros((rows, cols), dtype=np.int64)
+            counts[: self.counts.shape[0], : self.counts.shape[1]] = self.counts
+            self.counts = counts
+        self.counts += np.bincount(x * cols + y, minlength=rows * cols).reshape(rows, cols)
+
+    def nonzero(self):
+        x, y = np.nonzero(self.counts)
+        return x, y, self.counts[x, y]
+
+
+ENGINES = {"server": aggregate_throughput, "numpy": numpy_throughput}
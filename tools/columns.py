@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import shutil
+from pathlib import Path
+
+import numpy as np
+
+from settings import LOGGER
+
+# Integer columns use -1 for documents where the field is missing
+MISSING = -1
+STRING_FIELDS = {"name"}
+
+
+def to_columns(documents, fields):
+    columns = {}
+    for field in fields:
+        if field in STRING_FIELDS:
+            columns[field] = np.array([d.get(field) for d in documents], dtype=object)
+        else:
+            columns[field] = np.fromiter(
+                (MISSING if d.get(field) is None else d[field] for d in documents),
+                dtype=np.int64,
+                count=len(documents),
+            )
+    return columns
+
+
+def decode_columns(data, fields):
+    # Columns of a batch of concatenated BSON documents, as yielded by scan_raw
+    import bson
+
+    return to_columns(bson.decode_all(data), fields)
+
+
+# Per-collection field columns stored on disk and memory-mapped when read. Entries are keyed on
+# the database, collection, field set, document count and last inserted _id, so any data added by
+# the indexer produces a new key.
+class ColumnCache:
+    # Layout of the entries, part of their key so that older entries are rewritten
+    VERSION = 2
+
+    def __init__(self, root):
+        self.root = Path(root)
+
+    async def path(self, db, collection, fields):
+        count = await db[collection].estimated_document_count()
+        last = await db[collection].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+        fields_key = hashlib.sha1(",".join(sorted(fields)).encode()).hexdigest()[:12]
+        marker = last["_id"] if last else "empty"
+        return self.root / db.name / collection / f"{fields_key}-{count}-{marker}-v{self.VERSION}"
+
+    @staticmethod
+    def read(path, fields, batch_size):
+        with open(path / "meta.json") as file:
+            length = json.load(file)["length"]
+        if length == 0:
+            return
+        columns = {}
+        for field in fields:
+            if field in STRING_FIELDS:
+                columns[field] = (
+                    np.memmap(path / f"{field}.data", dtype=np.uint8, mode="r"),
+                    np.memmap(path / f"{field}.offsets", dtype=np.int64, mode="r"),
+                    np.memmap(path / f"{field}.missing", dtype=np.bool_, mode="r"),
+                )
+            else:
+                columns[field] = np.memmap(path / f"{field}.bin", dtype=np.int64, mode="r")
+
+        for start in range(0, length, batch_size):
+            end = min(start + batch_size, length)
+            batch = {}
+            for field, column in columns.items():
+                if field in STRING_FIELDS:
+                    data, offsets, missing = column
+                    blob = data[offsets[start] : offsets[end]].tobytes()
+                    bounds = (offsets[start : end + 1] - offsets[start]).tolist()
+                    batch[field] = np.array(
+                        [blob[bounds[i] : bounds[i + 1]].decode() for i in range(end - start)],
+                        dtype=object,
+                    )
+                    batch[field][missing[start:end]] = None
+                else:
+                    batch[field] = column[start:end]
+            yield batch
+
+
+class _CacheWriter:
+    def __init__(self, path, fields):
+        self.path = path
+        self.tmp_path = path.with_name(path.name + f".tmp-{os.getpid()}")
+        self.tmp_path.mkdir(parents=True, exist_ok=True)
+        self.fields = fields
+        self.length = 0
+        self.files = {}
+        self.offsets = {}
+        for field in fields:
+            if field in STRING_FIELDS:
+                # Missing strings are stored empty and flagged in <field>.missing
+                self.files[field] = (
+                    open(self.tmp_path / f"{field}.data", "wb"),
+                    open(self.tmp_path / f"{field}.offsets", "wb"),
+                    open(self.tmp_path / f"{field}.missing", "wb"),
+                )
+                self.offsets[field] = 0
+                np.zeros(1, dtype=np.int64).tofile(self.files[field][1])
+            else:
+                self.files[field] = open(self.tmp_path / f"{field}.bin", "wb")
+
+    def write(self, batch):
+        for field in self.fields:
+            if field in STRING_FIELDS:
+                data_file, offsets_file, missing_file = self.files[field]
+                missing = np.fromiter(
+                    (value is None for value in batch[field]),
+                    dtype=np.bool_,
+                    count=len(batch[field]),
+                )
+                missing.tofile(missing_file)
+                encoded = [(value or "").encode() for value in batch[field]]
+                lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded))
+                (self.offsets[field] + np.cumsum(lengths)).tofile(offsets_file)
+                self.offsets[field] += int(lengths.sum())
+                data_file.write(b"".join(encoded))
+            else:
+                batch[field].tofile(self.files[field])
+        self.length += len(batch[self.fields[0]])
+
+    def close(self):
+        for files in self.files.values():
+            for file in files if isinstance(files, tuple) else (files,):
+                file.close()
+        with open(self.tmp_path / "meta.json", "w") as file:
+            json.dump({"fields": self.fields, "length": self.length}, file)
+
+        try:
+            os.replace(self.tmp_path, self.path)
+        except OSError:
+            # Another process published the same entry first, it holds the same columns
+            LOGGER.debug(f"{self.path} was cached by another process")
+            shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+        # Older entries for the same fields are stale once the collection changed. The entries
+        # other processes are still writing (<name>.tmp-<pid>) are left alone.
+        prefix = self.path.name.split("-")[0]
+        for entry in self.path.parent.glob(f"{prefix}-*"):
+            if entry != self.path and ".tmp-" not in entry.name:
+                shutil.rmtree(entry, ignore_errors=True)
+
+    def abort(self):
+        for files in self.files.values():
+            for file in files if isinstance(files, tuple) else (files,):
+                file.close()
+        shutil.rmtree(self.tmp_path, ignore_errors=True)
+
+
+async def scan(db, collection, fields, cache=None, batch_size=100000, query=None):
+    # Yields the fields of every document as batches of columns, from the cache when possible. The
+    # cache only holds whole collections, so documents selected by a query are always read from
+    # the database.
+    fields = list(fields)
+    path = None
+    if cache is not None and query is None:
+        path = await cache.path(db, collection, fields)
+        if (path / "meta.json").exists():
+            LOGGER.debug(f"Reading {collection} from cache {path}")
+            for batch in ColumnCache.read(path, fields, batch_size):
+                yield batch
+            return
+
+    writer = _CacheWriter(path, fields) if path is not None else None
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = db[collection].find(query or {}, projection, batch_size=batch_size)
+    try:
+        while documents := await cursor.to_list(batch_size):
+            batch = to_columns(documents, fields)
+            if writer is not None:
+                writer.write(batch)
+            yield batch
+    except BaseException:
+        if writer is not None:
+            writer.abort()
+        raise
+    if writer is not None:
+        writer.close()
+        LOGGER.debug(f"Cached {collection} in {path}")
+
+
+async def scan_raw(db, collection, fields, batch_size=100000, query=None):
+    # Yields the fields of every document as undecoded batches of concatenated BSON documents, for
+    # worker processes to decode with decode_columns. Decoding costs far more than binning.
+    from bson.codec_options import CodecOptions
+    from bson.raw_bson import RawBSONDocument
+
+    raw = db[collection].with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    projection = {"_id": 0, **{field: 1 for field in fields}}
+    cursor = raw.find(query or {}, projection, batch_size=batch_size)
+    while documents := await cursor.to_list(batch_size):
+        yield b"".join(document.raw for document in documents)
@@ -1,65 +1,635 @@
 import argparse
 import asyncio
+import gzip
+import hashlib
+import io
 import json
+import multiprocessing
 import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
 
+import bson
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import BulkWriteError
 from tqdm import tqdm
 
+import settings
 from settings import (
-    DB,
     LOGGER,
+    MONGO_COLLECTION_CHECKPOINTS,
     MONGO_COLLECTION_DATA,
     MONGO_COLLECTION_FRAGMENT,
     MONGO_COLLECTION_INTEREST,
     MONGO_COLLECTION_NACK,
 )
+from tools.names import app_tag, name_length, name_prefixes
+from tools.rollups import RollupCounts, create_rollup_indexes, write_rollups
+
+try:
+    import orjson
+
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+GZIP_MAGIC = b"\x1f\x8b"
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+DUPLICATE_KEY = 11000
+
+# ndntdump fields read by the plots, kept by `--fields plots` along with the derived fields
+PLOT_FIELDS = ("t", "ts", "size2", "size3", "name", "hopLimit", "lifetime", "freshness")
+DERIVED_FIELDS = ("nameComponents", "nameLength", "prefixes", "app")
+# Stored as BSON integers (int32 when they fit) rather than doubles or strings, ts always as int64
+INT_FIELDS = {
+    "ts",
+    "size2",
+    "size3",
+    "hopLimit",
+    "lifetime",
+    "freshness",
+    "nameComponents",
+    "nameLength",
+}
+COMPRESSORS = ("snappy", "zlib", "zstd", "none")
+
+
+def detect_compression(stream):
+    magic = stream.peek(4)[:4]
+    if magic.startswith(GZIP_MAGIC):
+        return "gzip"
+    elif magic.startswith(ZSTD_MAGIC):
+        return "zstd"
+    return None
+
+
+def open_input(file_path):
+    # Binary stream over the decompressed input, "-" reads from stdin
+    stream = sys.stdin.buffer if file_path == "-" else open(file_path, "rb")
+    compression = detect_compression(stream)
+    if compression == "gzip":
+        return gzip.GzipFile(fileobj=stream)
+    elif compression == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            LOGGER.error("Error: Reading zstd compressed input requires `pip install zstandard`.")
+            exit(1)
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(stream))
+    return stream
+
+
+def skip_input(stream, offset):
+    # Offsets count decompressed bytes, streams that cannot seek are read up to the offset
+    if stream.seekable():
+        stream.seek(offset)
+        return
+    while offset > 0:
+        data = stream.read(min(offset, 1024 * 1024))
+        if not data:
+            break
+        offset -= len(data)
+
+
+def input_source(file_path, key=None):
+    # Checkpoint key of the input and its size. stdin has no size, and no key unless one is given:
+    # nothing tells two streams apart, so they must not share a checkpoint
+    if file_path == "-":
+        return key, None
+    return key or os.path.abspath(file_path), os.path.getsize(file_path)
+
+
+def packet_id(line):
+    # Same line, same _id: replaying a file inserts nothing twice
+    return bson.ObjectId(hashlib.blake2b(line.rstrip(), digest_size=12).digest())
+
+
+def packet_collection(packet):
+    packet_type = packet["t"]
+    if "I" in packet_type:
+        return MONGO_COLLECTION_INTEREST
+    elif "D" in packet_type:
+        return MONGO_COLLECTION_DATA
+    elif "N" in packet_type:
+        return MONGO_COLLECTION_NACK
+    else:
+        return MONGO_COLLECTION_FRAGMENT
+
+
+def chunk_ranges(file_path, chunk_size, start=0):
+    # Split the file from start into byte ranges that end on a newline
+    size = os.path.getsize(file_path)
+    with open(file_path, "rb") as file:
+        while start < size:
+            file.seek(min(start + chunk_size, size))
+            file.readline()
+            end = file.tell()
+            yield start, end
+            start = end
+
+
+def derive_fields(packet):
+    # Fields computed once at ingest so that plots do not have to re-parse every name
+    name = packet.get("name")
+    if name is None:
+        return packet
+    packet["nameComponents"] = len(name.split("/")) - 1
+    try:
+        packet["nameLength"] = name_length(name)
+    except ValueError:
+        pass
+    packet["prefixes"] = name_prefixes(name)
+    packet["app"] = app_tag(name)
+    return packet
+
+
+def compact_packet(packet, fields):
+    # Only the allowed fields, with the integer fields coerced
+    compact = {}
+    for field in fields:
+        value = packet.get(field)
+        if value is None:
+            continue
+        if field in INT_FIELDS and not isinstance(value, int):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                pass
+        compact[field] = value
+    if isinstance(compact.get("ts"), int):
+        compact["ts"] = bson.Int64(compact["ts"])
+    return compact
+
+
+def stream_chunks(stream, chunk_size):
+    # Read blocks of about chunk_size bytes that end on a newline
+    while data := stream.read(chunk_size):
+        yield data + stream.readline()
+
+
+def parse_chunk(data, derive=True, rollups=False, deterministic_ids=False, fields=None):
+    # Runs in a worker process: parse a block of lines and encode each packet to BSON so that
+    # only bytes are sent back to the main process, along with the rollup increments if asked
+    batches = {}
+    counts = RollupCounts() if rollups else None
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        packet = json_loads(line)
+        if derive:
+            derive_fields(packet)
+        collection = packet_collection(packet)
+        if counts is not None:
+            counts.add(collection, packet)
+        if fields is not None:
+            packet = compact_packet(packet, fields)
+        packet["_id"] = packet_id(line) if deterministic_ids else bson.ObjectId()
+        batches.setdefault(collection, []).append(bson.encode(packet))
+    return batches, counts
+
+
+def parse_range(
+    file_path, start, end, derive=True, rollups=False, deterministic_ids=False, fields=None
+):
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        return parse_chunk(file.read(end - start), derive, rollups, deterministic_ids, fields)
 
 
 class Indexer:
-    def __init__(self, db, batch_size=10000):
+    INDEXES = ("ts", "name", "app")
+    # Marks held back before the partly filled bulks they wait for are flushed
+    MARK_LAG = 4
+
+    def __init__(
+        self,
+        db,
+        batch_size=10000,
+        concurrency=4,
+        derive=True,
+        rollups=False,
+        checkpoints=MONGO_COLLECTION_CHECKPOINTS,
+        deterministic_ids=False,
+        fields=None,
+        checkpoint_key=None,
+    ):
         self.db = db
         self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.derive = derive
+        self.deterministic_ids = deterministic_ids
+        # Allow-list of the stored fields, None stores the ndntdump records as they are
+        if fields is not None and derive:
+            fields = tuple(fields) + tuple(field for field in DERIVED_FIELDS if field not in fields)
+        self.fields = fields
+        # Rollup increments since the last mark, written with the checkpoint of the mark
+        self.rollups = RollupCounts() if rollups else None
         self.bulk_data = {
             MONGO_COLLECTION_INTEREST: [],
             MONGO_COLLECTION_DATA: [],
             MONGO_COLLECTION_NACK: [],
             MONGO_COLLECTION_FRAGMENT: [],
         }
+        # Bounded number of unordered bulk writes in flight per collection
+        self.write_slots = {
+            collection: asyncio.Semaphore(concurrency) for collection in self.bulk_data
+        }
+        self.pending_writes = set()
+        self.write_error = None
+        # Checkpoints record the input offset up to which every document has been written. Each
+        # mark is an offset with the number of documents handed to each collection before it. A
+        # background task saves it with its rollups once the writes of those documents have all
+        # completed, one save at a time so that the rollup $inc upserts never race.
+        self.checkpoints = checkpoints
+        self.checkpoint_write = None
+        self.last_mark = None
+        # Key of the checkpoint instead of the file path, required to checkpoint stdin
+        self.checkpoint_key = checkpoint_key
+        self.source = None
+        self.source_size = None
+        self.resumed = {"packets": 0, "documents": {}}
+        self.marks = deque()
+        self.dispatched = {collection: 0 for collection in self.bulk_data}
+        # Insert tasks in flight, which the next checkpoint save waits for
+        self.inserts = set()
+        self.duplicates = 0
+        self.num_packets = 0
+        self.input_bytes = 0
+        self.parse_wait = None
+        self.write_wait = 0.0
+        self.write_time = 0.0
+
+    async def _write(self, collection, documents):
+        start = time.perf_counter()
+        try:
+            await self.db[collection].insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            # Documents with a deterministic _id may have been written before a resume
+            errors = e.details["writeErrors"]
+            if e.details.get("writeConcernErrors") or any(
+                error["code"] != DUPLICATE_KEY for error in errors
+            ):
+                raise
+            self.duplicates += len(errors)
+        finally:
+            self.write_time += time.perf_counter() - start
+            self.write_slots[collection].release()
+
+    def _write_done(self, task):
+        self.pending_writes.discard(task)
+        self.inserts.discard(task)
+        if not task.cancelled() and task.exception() and self.write_error is None:
+            self.write_error = task.exception()
+
+    async def _flush(self, collection):
+        # Surface failed writes early instead of parsing the rest of the file
+        if self.write_error is not None:
+            raise self.write_error
+
+        documents = self.bulk_data[collection][: self.batch_size]
+        del self.bulk_data[collection][: self.batch_size]
+
+        # Backpressure: wait for a free slot if too many batches are in flight
+        start = time.perf_counter()
+        await self.write_slots[collection].acquire()
+        self.write_wait += time.perf_counter() - start
+
+        task = asyncio.create_task(self._write(collection, documents))
+        self.pending_writes.add(task)
+        self.inserts.add(task)
+        self.dispatched[collection] += len(documents)
+        task.add_done_callback(self._write_done)
+        self._checkpoint()
+        # Let the write start so it commits while the next batch is parsed
+        await asyncio.sleep(0)
+
+    async def _mark(self, offset):
+        # Every packet before offset has been added to bulk_data and counted in the rollups
+        documents = {
+            collection: self.dispatched[collection] + len(data)
+            for collection, data in self.bulk_data.items()
+        }
+        rollups = self.rollups
+        if rollups is not None:
+            self.rollups = RollupCounts()
+        self.marks.append((offset, self.num_packets, documents, rollups))
+        if len(self.marks) > self.MARK_LAG:
+            # The bulk of a rare collection may stay partly filled for the rest of the input and
+            # hold back every later mark, so the oldest mark flushes the bulks it still waits for
+            for collection, count in self.marks[0][2].items():
+                if self.dispatched[collection] < count:
+                    await self._flush(collection)
+
+    def _checkpoint(self, done=False):
+        # Saves the last mark whose documents have all been handed to bulk writes, behind those
+        # writes. Marks wait while a save is in flight and are saved together by the next one.
+        if self.write_error is not None:
+            return
+        if self.checkpoint_write is not None and not self.checkpoint_write.done():
+            return
+        mark = None
+        rollups = RollupCounts()
+        while self.marks and all(
+            self.dispatched[collection] >= count for collection, count in self.marks[0][2].items()
+        ):
+            mark = self.marks.popleft()
+            if mark[3] is not None:
+                rollups.merge(mark[3])
+        if mark is None:
+            # The last checkpoint of the input is saved again as done
+            if not done or self.last_mark is None:
+                return
+            mark = self.last_mark
+        self.last_mark = mark
+        task = asyncio.create_task(self._save_checkpoint(list(self.inserts), mark, rollups, done))
+        self.checkpoint_write = task
+        self.pending_writes.add(task)
+        task.add_done_callback(self._write_done)
+
+    async def _save_checkpoint(self, writes, mark, rollups, done):
+        if writes:
+            await asyncio.wait(writes)
+        if self.write_error is not None:
+            return
+        start = time.perf_counter()
+        offset, packets, documents, _ = mark
+        # The rollups count the packets up to the checkpointed offset only, so that a resume
+        # does not count the packets after it twice. They are written just before the
+        # checkpoint, a crash between the two writes still counts those packets twice.
+        if rollups:
+            await write_rollups(self.db, rollups)
+        if self.checkpoints is not None and self.source is not None:
+            await self.db[self.checkpoints].replace_one(
+                {"_id": self.source},
+                {
+                    "offset": offset,
+                    "size": self.source_size,
+                    "packets": self.resumed["packets"] + packets,
+                    "documents": {
+                        collection: self.resumed["documents"].get(collection, 0) + count
+                        for collection, count in documents.items()
+                    },
+                    "deterministicIds": self.deterministic_ids,
+                    "done": done,
+                    "updated": datetime.now(timezone.utc),
+                },
+                upsert=True,
+            )
+        self.write_time += time.perf_counter() - start
+
+    async def resume(self, file_path):
+        # Offset to resume the file from, None when it has been indexed completely
+        source, size = input_source(file_path, self.checkpoint_key)
+        if source is None:
+            raise ValueError("Resuming stdin requires --checkpoint-key.")
+        checkpoint = await self.db[self.checkpoints].find_one({"_id": source})
+        if checkpoint is None:
+            LOGGER.info(f"No checkpoint for {source}, indexing from the start.")
+            return 0
+        if size is not None and checkpoint["size"] is not None and size < checkpoint["size"]:
+            raise ValueError(f"{source} is smaller than when it was checkpointed.")
+        if checkpoint["done"]:
+            LOGGER.info(f"{source} has already been indexed.")
+            return None
+        if checkpoint["deterministicIds"] and not self.deterministic_ids:
+            LOGGER.warning(
+                "The checkpoint was written with deterministic ids, documents written after it "
+                "may be inserted twice without --deterministic-ids."
+            )
+        self.resumed = {"packets": checkpoint["packets"], "documents": checkpoint["documents"]}
+        LOGGER.info(
+            f"Resuming {source} at byte {checkpoint['offset']:,} "
+            f"({checkpoint['packets']} packets already indexed)."
+        )
+        return checkpoint["offset"]
+
+    async def _drain(self):
+        start = time.perf_counter()
+        if self.pending_writes:
+            await asyncio.gather(*self.pending_writes)
+        self.write_wait += time.perf_counter() - start
+        if self.write_error is not None:
+            raise self.write_error
 
     async def _index_packet(self, type, packet):
         self.bulk_data[type].append(packet)
 
-        # If the batch is filled, perform bulk inserts
+        # If the batch is filled, hand it to a bulk write
         if len(self.bulk_data[type]) == self.batch_size:
-            await self.db[type].insert_many(self.bulk_data[type])
-            self.bulk_data[type] = []
+            await self._flush(type)
+
+    async def _index_packets(self, type, packets):
+        self.bulk_data[type].extend(packets)
+
+        while len(self.bulk_data[type]) >= self.batch_size:
+            await self._flush(type)
+
+    async def _flush_all(self):
+        # Perform remaining bulk inserts if any document is left
+        for collection, data in self.bulk_data.items():
+            while data:
+                await self._flush(collection)
+        await self._drain()
+        self._checkpoint(done=True)
+        await self._drain()
+
+    async def create_indexes(self):
+        LOGGER.info(f"Creating indexes on {', '.join(Indexer.INDEXES)}...")
+        await asyncio.gather(
+            *(
+                self.db[collection].create_index(field)
+                for collection in self.bulk_data
+                for field in Indexer.INDEXES
+                if field != "app" or self.derive
+            )
+        )
+        LOGGER.info("Indexes created.")
+
+    async def create_collections(self, compressor):
+        # The block compressor can only be chosen when the collection is created
+        existing = set(await self.db.list_collection_names())
+        for collection in self.bulk_data:
+            if collection in existing:
+                LOGGER.warning(f"{collection} already exists and keeps its block compressor.")
+                continue
+            await self.db.create_collection(
+                collection,
+                storageEngine={"wiredTiger": {"configString": f"block_compressor={compressor}"}},
+            )
 
-    def packets_generator(self, file_path):
-        with open(file_path) as file:
+    async def report_storage(self):
+        # Input, BSON and on-disk bytes per packet of each collection
+        if self.num_packets:
+            LOGGER.info(f"Input: {self.input_bytes / self.num_packets:,.0f} bytes/packet.")
+        for collection in self.bulk_data:
+            stats = {"count": 0, "size": 0, "storageSize": 0, "totalIndexSize": 0}
+            cursor = self.db[collection].aggregate([{"$collStats": {"storageStats": {}}}])
+            async for row in cursor:
+                for key in stats:
+                    stats[key] += row["storageStats"].get(key, 0)
+            if not stats["count"]:
+                continue
+            LOGGER.info(
+                f"{collection}: {stats['count']} packets, "
+                f"{stats['size'] / stats['count']:,.0f} BSON bytes/packet, "
+                f"{stats['storageSize'] / stats['count']:,.0f} bytes/packet on disk "
+                f"(+{stats['totalIndexSize'] / stats['count']:,.0f} in indexes)."
+            )
+
+    def lines_generator(self, file_path, offset=0):
+        # Non-empty lines with the offset they end at
+        with open_input(file_path) as file:
+            skip_input(file, offset)
             for line in file:
-                yield json.loads(line)
+                offset += len(line)
+                if line.strip():
+                    yield offset, line
+
+    def _report(self, elapsed):
+        rate = self.num_packets / elapsed if elapsed else 0
+        if self.parse_wait is None:
+            parse_time = elapsed - self.write_wait
+            parse_label = "Parsing"
+        else:
+            parse_time = self.parse_wait
+            parse_label = "Waiting on parsers"
+        LOGGER.info(
+            f"Indexed {self.num_packets} packets in {elapsed:.1f}s ({rate:,.0f} docs/s). "
+            f"{parse_label}: {parse_time:.1f}s, waiting on writes: {self.write_wait:.1f}s, "
+            f"write time (summed over in-flight batches): {self.write_time:.1f}s."
+        )
+        if self.duplicates:
+            LOGGER.info(f"Skipped {self.duplicates} documents already in the database.")
+        # Parsing never waits on writes unless every write slot is taken
+        if self.write_wait > parse_time:
+            LOGGER.info(
+                "Bottleneck: MongoDB writes. Consider raising --concurrency or --batch-size."
+            )
+        else:
+            LOGGER.info("Bottleneck: JSON parsing.")
 
-    async def index_json(self, file_path):
+    async def index_json(self, file_path, offset=0):
         progress_bar = tqdm(desc="Indexing packets", unit=" packet")
+        start = time.perf_counter()
+        self.source, self.source_size = input_source(file_path, self.checkpoint_key)
+        start_offset = offset
 
-        for packet in self.packets_generator(file_path):
-            packet_type = packet["t"]
-            if "I" in packet_type:
-                await self._index_packet(MONGO_COLLECTION_INTEREST, packet)
-            elif "D" in packet_type:
-                await self._index_packet(MONGO_COLLECTION_DATA, packet)
-            elif "N" in packet_type:
-                await self._index_packet(MONGO_COLLECTION_NACK, packet)
-            else:
-                await self._index_packet(MONGO_COLLECTION_FRAGMENT, packet)
+        for offset, line in self.lines_generator(file_path, offset):
+            packet = json_loads(line)
+            if self.derive:
+                derive_fields(packet)
+            collection = packet_collection(packet)
+            if self.rollups is not None:
+                self.rollups.add(collection, packet)
+            if self.fields is not None:
+                packet = compact_packet(packet, self.fields)
+            if self.deterministic_ids:
+                packet["_id"] = packet_id(line)
+            await self._index_packet(collection, packet)
 
+            self.num_packets += 1
             progress_bar.update()
+            if self.num_packets % self.batch_size == 0:
+                await self._mark(offset)
 
-        # Perform remaining bulk inserts if any document is left
-        for collection, data in self.bulk_data.items():
-            if data:
-                await self.db[collection].insert_many(data)
+        await self._mark(offset)
+        self.input_bytes = offset - start_offset
+        await self._flush_all()
+        progress_bar.close()
+
+        self._report(time.perf_counter() - start)
+        LOGGER.info("Done.")
+
+    async def index_json_parallel(self, file_path, workers, chunk_size=16 * 1024 * 1024, offset=0):
+        progress_bar = tqdm(desc="Indexing packets", unit=" packet")
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        self.parse_wait = 0.0
+        self.source, self.source_size = input_source(file_path, self.checkpoint_key)
+
+        async def index_next(pending):
+            wait_start = time.perf_counter()
+            end, result = pending.popleft()
+            batches, counts = await result
+            self.parse_wait += time.perf_counter() - wait_start
+            if counts is not None:
+                self.rollups.merge(counts)
+
+            for collection, documents in batches.items():
+                await self._index_packets(
+                    collection, [RawBSONDocument(document) for document in documents]
+                )
+                self.num_packets += len(documents)
+                progress_bar.update(len(documents))
+            await self._mark(end)
+            self.input_bytes = end - offset
+
+        async def index_chunks(pool, chunks):
+            # Keep a couple of chunks queued per worker; results are consumed in input order
+            pending = deque()
+            for end, args in chunks:
+                pending.append((end, loop.run_in_executor(pool, *args)))
+                if len(pending) >= 2 * workers:
+                    await index_next(pending)
+            while pending:
+                await index_next(pending)
 
+        compression = None
+        if file_path != "-":
+            with open(file_path, "rb") as file:
+                compression = detect_compression(file)
+
+        def data_chunks(stream):
+            end = offset
+            for data in stream_chunks(stream, chunk_size):
+                end += len(data)
+                yield end, (
+                    parse_chunk,
+                    data,
+                    self.derive,
+                    self.rollups is not None,
+                    self.deterministic_ids,
+                    self.fields,
+                )
+
+        # The workers start from a fork server: --resume and --compressor have already started the
+        # threads of the Motor client, and a forked worker could copy a lock held by one of them
+        with ProcessPoolExecutor(
+            workers, mp_context=multiprocessing.get_context("forkserver")
+        ) as pool:
+            if file_path == "-" or compression:
+                # Streams cannot be seeked, so the chunks themselves are sent to the workers
+                with open_input(file_path) as stream:
+                    skip_input(stream, offset)
+                    await index_chunks(pool, data_chunks(stream))
+            else:
+                await index_chunks(
+                    pool,
+                    (
+                        (
+                            range_end,
+                            (
+                                parse_range,
+                                file_path,
+                                range_start,
+                                range_end,
+                                self.derive,
+                                self.rollups is not None,
+                                self.deterministic_ids,
+                                self.fields,
+                            ),
+                        )
+                        for range_start, range_end in chunk_ranges(file_path, chunk_size, offset)
+                    ),
+                )
+
+        await self._flush_all()
+        progress_bar.close()
+
+        self._report(time.perf_counter() - start)
         LOGGER.info("Done.")
 
 
@@ -67,12 +637,128 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Index JSON file into MongoDB.", prog="python -m tools.index"
     )
-    parser.add_argument("file_path", help="Path to JSON file.")
+    parser.add_argument(
+        "file_path", help="Path to JSON file, optionally gzip or zstd compressed, or - for stdin."
+    )
+    parser.add_argument(
+        "--batch-size",
+        default=10000,
+        type=int,
+        help="Number of documents per bulk write (default: 10000)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default=4,
+        type=int,
+        help="Maximum in-flight bulk writes per collection (default: 4)",
+    )
+    parser.add_argument(
+        "--workers",
+        default=1,
+        type=int,
+        help="Number of processes parsing the file in parallel (default: 1)",
+    )
+    parser.add_argument(
+        "--chunk-size",
+        default=16,
+        type=int,
+        help="Size in MiB of the newline-aligned chunks handed to each worker (default: 16)",
+    )
+    parser.add_argument(
+        "--no-derived",
+        action="store_true",
+        help="Do not store the derived name fields (components, length, prefixes, app)",
+    )
+    parser.add_argument(
+        "--no-indexes", action="store_true", help="Do not create the indexes after loading"
+    )
+    parser.add_argument(
+        "--rollups",
+        action="store_true",
+        help="Also maintain the rollup collections read by the plots (per-minute throughput, hop "
+        "limit, lifetime and freshness counts, prefix counts)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue from the last checkpoint of the file instead of the start",
+    )
+    parser.add_argument(
+        "--checkpoint-key",
+        metavar="KEY",
+        help="Key of the checkpoint instead of the absolute file path. stdin is only checkpointed "
+        "with a key, which must be the same for every run of the same stream",
+    )
+    parser.add_argument(
+        "--deterministic-ids",
+        action="store_true",
+        help="Derive each _id from a hash of its line so that replayed lines are not inserted "
+        "twice",
+    )
+    parser.add_argument(
+        "--fields",
+        metavar="FIELDS",
+        help="Comma-separated ndntdump fields to store, or 'plots' for the fields read by the "
+        f"plots ({','.join(PLOT_FIELDS)}). The derived fields are kept unless --no-derived. "
+        "(default: every field)",
+    )
+    parser.add_argument(
+        "--compressor",
+        choices=COMPRESSORS,
+        help="Block compressor of the packet collections when they are created (default: the "
+        "server's, usually snappy)",
+    )
     args = parser.parse_args()
 
-    if not os.path.exists(args.file_path):
+    if args.file_path == "-" and args.resume and not args.checkpoint_key:
+        parser.error("--resume reads the checkpoint of --checkpoint-key when reading stdin")
+    if args.file_path != "-" and not os.path.exists(args.file_path):
         LOGGER.error(f"Error: The file {args.file_path} does not exist.")
         exit(1)
 
-    indexer = Indexer(DB)
-    asyncio.run(indexer.index_json(args.file_path))
+    fields = None
+    if args.fields == "plots":
+        fields = PLOT_FIELDS
+    elif args.fields:
+        fields = tuple(field.strip() for field in args.fields.split(",") if field.strip())
+
+    async def main():
+        indexer = Indexer(
+            settings.DB,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            derive=not args.no_derived,
+            rollups=args.rollups,
+            deterministic_ids=args.deterministic_ids,
+            fields=fields,
+            checkpoint_key=args.checkpoint_key,
+        )
+        if args.file_path == "-" and not args.checkpoint_key:
+            LOGGER.info("stdin is not checkpointed without --checkpoint-key.")
+        offset = 0
+        if args.resume:
+            try:
+                offset = await indexer.resume(args.file_path)
+            except ValueError as e:
+                LOGGER.error(f"Error: {e}")
+                exit(1)
+            if offset is None:
+                return
+        if args.compressor:
+            await indexer.create_collections(args.compressor)
+        if args.rollups:
+            await create_rollup_indexes(settings.DB)
+        if args.workers > 1:
+            await indexer.index_json_parallel(
+                args.file_path,
+                args.workers,
+                chunk_size=args.chunk_size * 1024 * 1024,
+                offset=offset,
+            )
+        else:
+            await indexer.index_json(args.file_path, offset)
+        if not args.no_indexes:
+            await indexer.create_indexes()
+        await indexer.report_storage()
+
+    asyncio.run(main())
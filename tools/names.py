@@ -0,0 +1,217 @@
+import heapq
+import re
+from array import array
+from functools import lru_cache
+
+PREFIX_LEVELS = 5
+
+TYPE_NAME = 0x07
+# Characters left as they are by Component.escape_str, every other character is percent-encoded
+_UNRESERVED = re.compile(r"[A-Za-z0-9\-._~=%]*")
+# Characters that Component.to_str prints as they are
+_PLAIN = re.compile(r"[A-Za-z0-9\-._~]*")
+_HEX_BYTES = re.compile(r"(?:[0-9A-Fa-f]{2})*")
+# python-ndn decodes the two characters after % with int(..., 16), which also accepts "-0"
+_BAD_PERCENT = re.compile(r"%(?![0-9A-Fa-f]{2}|-0)")
+_DIGEST_TYPES = {
+    "sha256digest": "TYPE_IMPLICIT_SHA256",
+    "params-sha256": "TYPE_PARAMETERS_SHA256",
+}
+
+# Application tags are matched in order as substrings of the name, otherwise the first component
+# of the name is used as the tag
+APP_TAGS = ("nlsr",)
+
+
+def name_components(name):
+    return name.split("/")[1:]
+
+
+def name_prefixes(name, levels=PREFIX_LEVELS):
+    components = name_components(name)
+    return ["/" + "/".join(components[:i]) for i in range(1, min(len(components), levels) + 1)]
+
+
+def app_tag(name):
+    for tag in APP_TAGS:
+        if tag in name:
+            return tag
+    components = name_components(name)
+    return components[0] if components else None
+
+
+def uri_components(name):
+    # Components of a URI as split by Name.from_str: one leading and one trailing slash are dropped
+    slashes = 0
+    if name.startswith("/"):
+        name = name[1:]
+        slashes += 1
+    if name.endswith("/"):
+        name = name[:-1]
+        slashes += 1
+    if not name and slashes <= 1:
+        return []
+    return name.split("/")
+
+
+def varnum_size(value):
+    if value <= 0xFC:
+        return 1
+    elif value <= 0xFFFF:
+        return 3
+    elif value <= 0xFFFFFFFF:
+        return 5
+    return 9
+
+
+def _uint_size(value):
+    if value < 0:
+        raise ValueError(f"{value} is not a non-negative number")
+    if value <= 0xFF:
+        return 1
+    elif value <= 0xFFFF:
+        return 2
+    elif value <= 0xFFFFFFFF:
+        return 4
+    return 8
+
+
+def _number(value):
+    # int() also accepts spaces and non-ASCII digits, which python-ndn escapes before parsing
+    if not _UNRESERVED.fullmatch(value):
+        raise ValueError(f"{value} is not a number")
+    return int(value)
+
+
+@lru_cache(maxsize=1 << 16)
+def component_size(component):
+    # Size of the TLV that Component.from_str(Component.escape_str(component)) encodes. python-ndn
+    # is imported on first use, it takes longer to import than the plots take to start.
+    from ndn.encoding.name import Component
+
+    typ = Component.TYPE_GENERIC
+    value = component
+    if "=" in component:
+        typ_str, _, value = component.partition("=")
+        if "=" in value:
+            raise ValueError(f"{component} has multiple TLV types")
+        if typ_str in _DIGEST_TYPES:
+            if not _HEX_BYTES.fullmatch(value):
+                raise ValueError(f"{component} is not a hexadecimal digest")
+            typ = getattr(Component, _DIGEST_TYPES[typ_str])
+            length = len(value) // 2
+            return varnum_size(typ) + varnum_size(length) + length
+        if typ_str in Component.ALTERNATE_URI_STR:
+            typ = Component.ALTERNATE_URI_STR[typ_str]
+            length = _uint_size(_number(value))
+            return varnum_size(typ) + varnum_size(length) + length
+        typ = _number(typ_str)
+        if typ <= 0 or typ > Component.MAX_COMPONENT_TYPE_VALUE:
+            raise ValueError(f"Type number {typ} not in range 0<T<=65535")
+    if "%" in value:
+        if _BAD_PERCENT.search(value):
+            raise ValueError(f"{component} has an invalid percent-encoding")
+        length = len(value.encode("utf-8")) - 2 * value.count("%")
+    else:
+        length = len(value.encode("utf-8"))
+    return varnum_size(typ) + varnum_size(length) + length
+
+
+def name_length(name):
+    # Same as len(Name.to_bytes(name)) without building the TLV, names that share components reuse
+    # the memoized component sizes
+    length = sum(map(component_size, uri_components(name)))
+    return varnum_size(TYPE_NAME) + varnum_size(length) + length
+
+
+@lru_cache(maxsize=1 << 16)
+def component_uri(component):
+    if _PLAIN.fullmatch(component):
+        return component
+    from ndn.encoding.name import Component
+
+    return Component.to_str(Component.from_str(Component.escape_str(component)))
+
+
+def name_uri(name):
+    # Same as Name.to_str(Name.from_str(name)), only the components that are not plain text go
+    # through python-ndn
+    components = [component_uri(component) for component in uri_components(name)]
+    uri = "/" + "/".join(components)
+    if components and components[-1] == "":
+        uri += "/"
+    return uri
+
+
+def name_matcher(match):
+    # A match starting with a slash is a name prefix, anything else a substring of the name
+    if match.startswith("/"):
+        return lambda name: name.startswith(match)
+    return lambda name: match in name
+
+
+def match_filter(match):
+    # MongoDB filter for the names accepted by name_matcher(match)
+    if match.startswith("/"):
+        # An anchored regex is bounded on the name index
+        return {"name": {"$regex": "^" + re.escape(match)}}
+    pattern = {"$regex": re.escape(match)}
+    if match not in APP_TAGS:
+        return {"name": pattern}
+    # The indexer tags a name with the first of APP_TAGS it contains, so only names tagged with an
+    # earlier tag or indexed without the derived fields need the regex
+    earlier = list(APP_TAGS[: APP_TAGS.index(match)])
+    return {"$or": [{"app": match}, {"app": {"$in": [*earlier, None]}, "name": pattern}]}
+
+
+# Counts name prefixes in a trie of interned components. A node is keyed by its parent node and the
+# id of its last component, so no prefix string is built while counting.
+class PrefixTrie:
+    def __init__(self, levels=PREFIX_LEVELS):
+        self.levels = levels
+        self.component_ids = {}
+        self.component_names = []
+        self.children = {}
+        # Per node arrays, node 0 is the root
+        self.parents = array("q", [-1])
+        self.labels = array("q", [-1])
+        self.depths = array("B", [0])
+        self.counts = array("Q", [0])
+
+    def add(self, name):
+        node = 0
+        for depth, component in enumerate(name_components(name)[: self.levels], start=1):
+            component_id = self.component_ids.get(component)
+            if component_id is None:
+                component_id = self.component_ids[component] = len(self.component_names)
+                self.component_names.append(component)
+            key = node << 32 | component_id
+            child = self.children.get(key)
+            if child is None:
+                child = self.children[key] = len(self.counts)
+                self.parents.append(node)
+                self.labels.append(component_id)
+                self.depths.append(depth)
+                self.counts.append(0)
+            self.counts[child] += 1
+            node = child
+
+    def update(self, names):
+        for name in names:
+            self.add(name)
+
+    def prefix(self, node):
+        components = []
+        while node > 0:
+            components.append(self.component_names[self.labels[node]])
+            node = self.parents[node]
+        return "/" + "/".join(reversed(components))
+
+    def most_common(self, level, n):
+        # Nodes are numbered in order of first appearance, so ties keep the Counter order
+        nodes = (node for node, depth in enumerate(self.depths) if depth == level)
+        top = heapq.nlargest(n, nodes, key=self.counts.__getitem__)
+        return [(self.prefix(node), self.counts[node]) for node in top]
+
+    def __len__(self):
+        return len(self.counts) - 1
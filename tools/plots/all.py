@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import os
+
+import settings
+from settings import *
+from tools.binning import parse_time
+from tools.columns import ColumnCache
+from tools.plots.base import EXPORT_FORMATS, add_common_args, scan_plots
+from tools.plots.components_hexbin import ComponentsHexbin
+from tools.plots.content_size_distribution import NLSRContentSizeDistribution
+from tools.plots.hoplimit import HopLimit
+from tools.plots.lifetime_freshness import LifetimeFreshnessCDF
+from tools.plots.popular_prefixes import PopularPrefixes
+from tools.plots.throughput import PacketsHistogramThroughput
+from tools.render import MAX_VERTICES
+
+PLOTS = {
+    "throughput": PacketsHistogramThroughput,
+    "popular_prefixes": PopularPrefixes,
+    "components_hexbin": ComponentsHexbin,
+    "lifetime_freshness": LifetimeFreshnessCDF,
+    "hoplimit": HopLimit,
+    "content_size_distribution": NLSRContentSizeDistribution,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Plot several figures from a single scan of each collection",
+        prog="python -m tools.plots.all",
+    )
+    parser.add_argument(
+        "plots",
+        nargs="*",
+        metavar="PLOT",
+        help=f"Plots to render (default: all). Choices: {', '.join(PLOTS)}",
+    )
+    parser.add_argument(
+        "--duration",
+        default=60,
+        type=int,
+        help="Duration in minutes to group packets for throughput (default: 60)",
+    )
+    parser.add_argument(
+        "--since",
+        type=parse_time,
+        metavar="TIME",
+        help="Only bin the throughput packets from TIME, an ISO date in UTC or a duration before "
+        "now such as 24h",
+    )
+    parser.add_argument(
+        "--until",
+        type=parse_time,
+        metavar="TIME",
+        help="Only bin the throughput packets before TIME, an ISO date in UTC or a duration before "
+        "now",
+    )
+    add_common_args(parser, dbs=False, export=False, output=False)
+    parser.add_argument(
+        "--max-vertices",
+        nargs="?",
+        const=MAX_VERTICES,
+        type=int,
+        metavar="N",
+        help="Draw the line series and CDFs with at most about N vertices each "
+        f"(default: {MAX_VERTICES})",
+    )
+    parser.add_argument(
+        "--export",
+        choices=EXPORT_FORMATS,
+        help="Write the computed series to DIR/<plot>-<table>.<format> instead of plotting, "
+        "with -o DIR",
+    )
+    parser.add_argument(
+        "-o",
+        "--output-dir",
+        metavar="DIR",
+        type=str,
+        help="Save each plot to DIR/<plot>.pdf instead of showing it.",
+    )
+    args = parser.parse_args()
+    for name in args.plots:
+        if name not in PLOTS:
+            parser.error(f"unknown plot {name!r} (choose from {', '.join(PLOTS)})")
+    if args.export and not args.output_dir:
+        parser.error("--export writes the tables to -o DIR")
+
+    collections = {
+        "INTEREST": MONGO_COLLECTION_INTEREST,
+        "DATA": MONGO_COLLECTION_DATA,
+        "NACK": MONGO_COLLECTION_NACK,
+        "FRAGMENT": MONGO_COLLECTION_FRAGMENT,
+    }
+    plots = []
+    for name in args.plots or PLOTS:
+        plot = PLOTS[name](settings.DB, collections)
+        plot.rollups = not args.raw
+        plot.max_vertices = args.max_vertices
+        if args.output_dir:
+            plot.output = os.path.join(args.output_dir, name)
+        plots.append(plot)
+        if isinstance(plot, PacketsHistogramThroughput):
+            plot.duration = args.duration
+            plot.since = args.since
+            plot.until = args.until
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    async def main():
+        await scan_plots(
+            settings.DB, collections, plots, ColumnCache(args.cache) if args.cache else None
+        )
+        for plot in plots:
+            if args.export:
+                plot.export(args.export)
+            else:
+                plot.render()
+
+    asyncio.run(main())
@@ -0,0 +1,200 @@
+from importlib.util import find_spec
+from pathlib import PurePath
+
+import settings
+from settings import LOGGER, PLOT_CACHE_DIR
+from tools.binning import ENGINES
+from tools.columns import ColumnCache, scan
+from tools.render import decimate
+from tools.sources import DataSource
+
+# Formats of the computed series written by Plot.export, with pandas
+EXPORT_FORMATS = ("csv", "parquet", "json")
+
+
+# Plots accumulate the fields they need from batches of columns (see tools.columns.scan), so that
+# several plots can share a single scan of each collection. compute() reads and aggregates the data
+# without matplotlib, render() draws the computed state and tables() returns it as compact arrays.
+class Plot:
+    def __init__(self, db, collections):
+        self.db = db
+        self.collections = collections
+        self.output = False
+        self.cache = None
+        # Read the rollup collections maintained by the indexer when they cover the data
+        self.rollups = True
+        # DataSource running the server-side aggregations on several databases instead of db
+        self.source = None
+        # Bound on the vertices drawn per series (see tools.render), None draws every vertex
+        self.max_vertices = None
+        # Fields needed from each collection, keyed like `collections`
+        self.fields = {}
+
+    async def prepare(self):
+        pass
+
+    async def from_rollups(self):
+        # Fills the plot from the rollups instead of the scan, False when it cannot
+        return False
+
+    async def run_pipeline(self, collection, pipeline, **kwargs):
+        # Rows of the aggregation, merged over the databases of the source when there is one
+        if self.source is not None:
+            return await self.source.aggregate(collection, pipeline, **kwargs)
+        return [row async for row in self.db[collection].aggregate(pipeline, **kwargs)]
+
+    def line(self, x, y):
+        # Vertices of a line series, decimated to max_vertices
+        if self.max_vertices is None:
+            return x, y
+        return decimate(x, y, self.max_vertices)
+
+    def update(self, name, batch):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+    async def compute(self):
+        await scan_plots(self.db, self.collections, [self], self.cache)
+        return self.tables()
+
+    def tables(self):
+        # The computed series as {table: {column: array}}
+        raise NotImplementedError
+
+    def render(self):
+        raise NotImplementedError
+
+    def save(self, fig, label):
+        if self.output:
+            filename = PurePath(self.output).with_suffix(".pdf")
+            fig.savefig(filename, bbox_inches="tight", dpi=300)
+            LOGGER.info(f"{label} saved to {filename}")
+        else:
+            import matplotlib.pyplot as plt
+
+            plt.show()
+
+    def export(self, fmt):
+        # Writes each table to <output>-<table>.<fmt>
+        if fmt == "parquet" and not (find_spec("pyarrow") or find_spec("fastparquet")):
+            LOGGER.error("Error: Exporting to Parquet requires `pip install pyarrow`.")
+            exit(1)
+        import pandas as pd
+
+        stem = PurePath(self.output).with_suffix("")
+        for table, columns in self.tables().items():
+            frame = pd.DataFrame(columns)
+            filename = f"{stem}-{table}.{fmt}"
+            if fmt == "csv":
+                frame.to_csv(filename, index=False)
+            elif fmt == "parquet":
+                frame.to_parquet(filename, index=False)
+            else:
+                frame.to_json(filename, orient="records", date_format="iso")
+            LOGGER.info(f"{len(frame)} rows of {table} exported to {filename}")
+
+    async def plot(self, export=None):
+        # With an export format, the computed series are written instead of drawn
+        await self.compute()
+        if export:
+            self.export(export)
+        else:
+            self.render()
+
+
+async def scan_plots(db, collections, plots, cache=None):
+    # One pass per collection with the union of the fields the plots need
+    for plot in plots:
+        await plot.prepare()
+    rollup_plots = [plot for plot in plots if plot.rollups and await plot.from_rollups()]
+    for plot in rollup_plots:
+        LOGGER.info(f"{type(plot).__name__} read from the rollups")
+    plots = [plot for plot in plots if plot not in rollup_plots]
+
+    for name, collection in collections.items():
+        readers = [plot for plot in plots if name in plot.fields]
+        if not readers:
+            continue
+        fields = sorted({field for plot in readers for field in plot.fields[name]})
+        LOGGER.info(f"Scanning {collection} for {', '.join(type(p).__name__ for p in readers)}...")
+        async for batch in scan(db, collection, fields, cache):
+            for plot in readers:
+                plot.update(name, batch)
+
+    for plot in plots:
+        plot.finish()
+
+
+def add_common_args(parser, binning=False, raw=True, dbs=True, export=True, output=True):
+    # Options shared by the plotting scripts, read back with check_common_args and
+    # apply_common_args. The flags add the options of the plots that support them.
+    if binning:
+        parser.add_argument(
+            "--duration",
+            default=60,
+            type=int,
+            help="Duration in minutes to group packets (default: 60)",
+        )
+        parser.add_argument(
+            "--engine",
+            default="server",
+            choices=ENGINES,
+            help="Bin on the MongoDB server or client-side with NumPy (default: server)",
+        )
+    parser.add_argument(
+        "--cache",
+        nargs="?",
+        const=PLOT_CACHE_DIR,
+        metavar="DIR",
+        help=f"Read the fields through a local columnar cache (default: {PLOT_CACHE_DIR})",
+    )
+    if raw:
+        parser.add_argument(
+            "--raw", action="store_true", help="Read the packets even when rollups are available"
+        )
+    if dbs:
+        parser.add_argument(
+            "--dbs",
+            nargs="+",
+            metavar="PATTERN",
+            help="Aggregate the site databases given as names or globs together instead of "
+            "MONGO_DB_NAME",
+        )
+        parser.add_argument(
+            "--concurrency",
+            default=4,
+            type=int,
+            help="Number of databases aggregated at the same time with --dbs (default: 4)",
+        )
+    if export:
+        parser.add_argument(
+            "--export",
+            choices=EXPORT_FORMATS,
+            help="Write the computed series to FILE-<table>.<format> instead of plotting, with "
+            "-o FILE",
+        )
+    if output:
+        parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+
+
+def check_common_args(parser, args):
+    if getattr(args, "export", None) and not args.output:
+        parser.error("--export writes the tables next to -o FILE")
+
+
+def apply_common_args(plot, args):
+    plot.output = args.output
+    plot.cache = ColumnCache(args.cache) if args.cache else None
+    if "raw" in args:
+        plot.rollups = not args.raw
+    if "engine" in args:
+        plot.engine = args.engine
+
+
+async def open_source(args):
+    # DataSource of the databases matched by --dbs, None without it
+    if not getattr(args, "dbs", None):
+        return None
+    return await DataSource.matching(settings.DB_CLIENT, args.dbs, args.concurrency)
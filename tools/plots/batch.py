@@ -0,0 +1,155 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import settings
+from settings import *
+from tools.binning import parse_time
+from tools.columns import ColumnCache
+from tools.plots import style
+from tools.plots.all import PLOTS
+from tools.plots.base import add_common_args, scan_plots
+from tools.sources import parse_database, site_databases
+
+COLLECTIONS = {
+    "INTEREST": MONGO_COLLECTION_INTEREST,
+    "DATA": MONGO_COLLECTION_DATA,
+    "NACK": MONGO_COLLECTION_NACK,
+    "FRAGMENT": MONGO_COLLECTION_FRAGMENT,
+}
+# Options given like --since and --until, as ISO dates (YAML may load them as datetimes) or
+# durations before now
+TIME_OPTIONS = ("since", "until")
+# Output of the jobs that do not set one, formatted with the plot, db, site and day
+DEFAULT_OUTPUT = os.path.join("{db}", "{plot}")
+
+
+def load_spec(path):
+    # A mapping with the jobs list, and optional output_dir and defaults (plot options applied to
+    # every job that has them)
+    with open(path) as file:
+        if path.endswith((".yaml", ".yml")):
+            import yaml
+
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+async def expand_jobs(client, spec):
+    # One job per plot and database, with the database globs expanded
+    jobs = []
+    for job in spec["jobs"]:
+        if job.get("plot") not in PLOTS:
+            raise ValueError(f"Unknown plot {job.get('plot')!r} (choose from {', '.join(PLOTS)})")
+        output = os.path.join(spec.get("output_dir", "."), job.get("output", DEFAULT_OUTPUT))
+        for db in await site_databases(client, [job.get("db", MONGO_DB_NAME)]):
+            site, day = parse_database(db)
+            jobs.append(
+                {
+                    "plot": job["plot"],
+                    "db": db,
+                    "output": output.format(plot=job["plot"], db=db, site=site, day=day or ""),
+                    "options": job.get("options", {}),
+                }
+            )
+    return jobs
+
+
+def create_plot(job, db, defaults):
+    plot = PLOTS[job["plot"]](db, COLLECTIONS)
+    for option, value in defaults.items():
+        if hasattr(plot, option):
+            setattr(plot, option, value)
+    for option, value in job["options"].items():
+        if not hasattr(plot, option):
+            raise ValueError(f"{type(plot).__name__} has no option {option!r}")
+        setattr(plot, option, value)
+    for option in TIME_OPTIONS:
+        value = getattr(plot, option, None)
+        if value is not None and not isinstance(value, int):
+            setattr(plot, option, parse_time(str(value)))
+    plot.output = job["output"]
+    return plot
+
+
+def render(plot):
+    # Runs in a worker process with the Agg backend
+    import matplotlib.pyplot as plt
+
+    plot.render()
+    plt.close("all")
+    return plot.output
+
+
+async def run(spec, workers, cache=None):
+    jobs = await expand_jobs(settings.DB_CLIENT, spec)
+    if not jobs:
+        raise ValueError("No job matches a database.")
+    jobs_per_db = {}
+    for job in jobs:
+        jobs_per_db.setdefault(job["db"], []).append(job)
+
+    loop = asyncio.get_running_loop()
+    renders = []
+    # The workers start from a fork server: forking this process after the Motor client started
+    # its threads could copy a lock held by one of them
+    with ProcessPoolExecutor(
+        workers,
+        mp_context=multiprocessing.get_context("forkserver"),
+        initializer=style.setup,
+        initargs=("Agg",),
+    ) as executor:
+        # The figures of a database render while the next database is read
+        for name, db_jobs in jobs_per_db.items():
+            db = settings.DB_CLIENT[name]
+            plots = [create_plot(job, db, spec.get("defaults", {})) for job in db_jobs]
+            LOGGER.info(f"Reading {name} for {len(plots)} plots...")
+            await scan_plots(db, COLLECTIONS, plots, cache)
+            for plot in plots:
+                os.makedirs(os.path.dirname(plot.output) or ".", exist_ok=True)
+                # Only the computed state is sent to the workers
+                plot.db = None
+                plot.cache = None
+                renders.append(loop.run_in_executor(executor, render, plot))
+        results = await asyncio.gather(*renders, return_exceptions=True)
+
+    failed = 0
+    for job, result in zip((job for db_jobs in jobs_per_db.values() for job in db_jobs), results):
+        if isinstance(result, Exception):
+            failed += 1
+            LOGGER.error(f"{job['plot']} of {job['db']} failed: {result!r}")
+    LOGGER.info(f"Rendered {len(results) - failed} of {len(results)} figures.")
+    return failed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render the figures listed in a job spec, reading each database once",
+        prog="python -m tools.plots.batch",
+    )
+    parser.add_argument(
+        "spec",
+        help="JSON or YAML job spec: {output_dir, defaults, jobs: [{plot, db, output, options}]}",
+    )
+    parser.add_argument(
+        "--workers",
+        default=os.cpu_count(),
+        type=int,
+        help="Processes rendering the figures (default: number of CPUs)",
+    )
+    add_common_args(parser, raw=False, dbs=False, export=False, output=False)
+    args = parser.parse_args()
+
+    style.setup("Agg")
+    try:
+        failed = asyncio.run(
+            run(load_spec(args.spec), args.workers, ColumnCache(args.cache) if args.cache else None)
+        )
+    except ValueError as e:
+        LOGGER.error(f"Error: {e}")
+        exit(1)
+    if failed:
+        exit(1)
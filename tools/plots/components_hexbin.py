@@ -1,89 +1,133 @@
 import argparse
 import asyncio
-from pathlib import PurePath
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from matplotlib import colors
-from ndn.encoding import Name
 
+import settings
 from settings import *
+from tools.binning import CountGrid
+from tools.columns import MISSING
+from tools.names import name_length
+from tools.plots import style
+from tools.plots.base import Plot, add_common_args, apply_common_args, check_common_args
+from tools.render import density_mesh
 
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
 
+def _sum_at_least(min_count):
+    def reduce(counts):
+        total = np.sum(counts)
+        return total if total >= min_count else np.nan
+
+    return reduce
+
+
+class ComponentsHexbin(Plot):
+    MIN_COUNT = 25
 
-class ComponentsHexbin:
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self):
-        LOGGER.info("Getting the packets...")
-        i_d = []
-        d_d = []
-        for collection in self.collections.values():
-            async for document in self.db[collection].find({}, {"name": 1, "_id": 0}):
-                n = document["name"]
-                num_c = len(n.split("/")) - 1
+        super().__init__(db, collections)
+        self.fields = {
+            name: ("name", "nameComponents", "nameLength") for name in ("INTEREST", "DATA")
+        }
+        # Keep every (components, length) point instead of a count grid
+        self.keep_points = False
+        # Pre-bin the kept points in a mesh (see tools.render.density_mesh) before the hexbin
+        self.mesh = False
+        self.points = {}
+        self.grids = {}
+
+    async def prepare(self):
+        self.points = {"INTEREST": [], "DATA": []}
+        self.grids = {"INTEREST": CountGrid(), "DATA": CountGrid()}
+
+    def update(self, name, batch):
+        # Use the fields derived by the indexer when they are present
+        num_components = np.array(batch["nameComponents"])
+        name_lengths = np.array(batch["nameLength"])
+        for i in np.flatnonzero((num_components == MISSING) | (name_lengths == MISSING)):
+            n = batch["name"][i]
+            if num_components[i] == MISSING:
+                num_components[i] = len(n.split("/")) - 1
+            if name_lengths[i] == MISSING:
                 try:
-                    name_len = len(Name.to_bytes(n))
+                    name_lengths[i] = name_length(n)
                 except ValueError as e:
                     LOGGER.warning(f"Invalid name: {n}. Error: {e}")
-                    continue
+        valid = name_lengths != MISSING
+        num_components = num_components[valid]
+        name_lengths = name_lengths[valid]
 
-                if collection == self.collections["INTEREST"]:
-                    i_d.append((num_c, name_len))
-                elif collection == self.collections["DATA"]:
-                    d_d.append((num_c, name_len))
+        if self.keep_points:
+            self.points[name].extend(zip(num_components.tolist(), name_lengths.tolist()))
+        else:
+            self.grids[name].add(num_components, name_lengths)
+
+    def counts(self, name):
+        # Packets per distinct (components, name length)
+        if not self.keep_points:
+            return self.grids[name].nonzero()
+        points = np.array(self.points[name], dtype=np.int64).reshape(-1, 2)
+        points, counts = np.unique(points, axis=0, return_counts=True)
+        return points[:, 0], points[:, 1], counts
+
+    def tables(self):
+        names = ("INTEREST", "DATA")
+        components, name_lengths, counts = zip(*(self.counts(name) for name in names))
+        return {
+            "names": {
+                "packet": np.repeat(np.array(names, dtype=object), [len(c) for c in counts]),
+                "components": np.concatenate(components),
+                "name_length": np.concatenate(name_lengths),
+                "count": np.concatenate(counts),
+            }
+        }
+
+    def hexbin(self, ax, name, **kwargs):
+        if self.keep_points and not self.mesh:
+            return ax.hexbin(
+                *zip(*self.points[name]), gridsize=25, mincnt=ComponentsHexbin.MIN_COUNT, **kwargs
+            )
+        # Every grid cell falls in a single hexagon, so summing the cell counts per hexagon gives
+        # the same hexagons and counts as binning the points
+        if self.keep_points:
+            x, y, counts = density_mesh(*np.array(self.points[name]).T)
+        else:
+            x, y, counts = self.grids[name].nonzero()
+        return ax.hexbin(
+            x,
+            y,
+            C=counts,
+            reduce_C_function=_sum_at_least(ComponentsHexbin.MIN_COUNT),
+            gridsize=25,
+            mincnt=0,
+            **kwargs,
+        )
+
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib import colors
+
+        style.setup()
 
         LOGGER.info("Plotting...")
         sns.set_context("paper", font_scale=2)
         fig, ax = plt.subplots(figsize=(14, 8))
         ax.tick_params(axis="both", which="major")
-        hb1 = ax.hexbin(
-            *zip(*i_d),
-            gridsize=25,
-            cmap="Blues",
-            alpha=0.9,
-            mincnt=25,
-            edgecolors="blue",
-        )
-        hb2 = ax.hexbin(
-            *zip(*d_d),
-            gridsize=25,
-            cmap="Oranges",
-            alpha=0.9,
-            mincnt=25,
-            edgecolors="orange",
-        )
+        hb1 = self.hexbin(ax, "INTEREST", cmap="Blues", alpha=0.9, edgecolors="blue")
+        hb2 = self.hexbin(ax, "DATA", cmap="Oranges", alpha=0.9, edgecolors="orange")
 
         max_count = max(hb1.get_array().max(), hb2.get_array().max())
         min_count = min(hb1.get_array().min(), hb2.get_array().min())
         norm = colors.Normalize(vmin=min_count, vmax=max_count)
 
-        hb1 = ax.hexbin(
-            *zip(*i_d),
-            gridsize=25,
-            cmap="Blues",
-            norm=norm,
-            alpha=0.9,
-            mincnt=25,
-            edgecolors="blue",
-        )
-        hb2 = ax.hexbin(
-            *zip(*d_d),
-            gridsize=25,
-            cmap="Oranges",
-            norm=norm,
-            alpha=0.9,
-            mincnt=25,
-            edgecolors="orange",
-        )
+        if self.keep_points and not self.mesh:
+            hb1 = self.hexbin(ax, "INTEREST", cmap="Blues", norm=norm, alpha=0.9, edgecolors="blue")
+            hb2 = self.hexbin(ax, "DATA", cmap="Oranges", norm=norm, alpha=0.9, edgecolors="orange")
+        else:
+            # The aggregated hexagons are cheap to renormalize in place
+            hb1.set_norm(norm)
+            hb2.set_norm(norm)
 
         cb1 = fig.colorbar(hb1)
         cb2 = fig.colorbar(hb2)
@@ -102,12 +146,7 @@ class ComponentsHexbin:
         ax.yaxis.set_ticks(np.arange(0, 801, 50))
         # Custom: End
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Hexbin saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Hexbin")
 
 
 if __name__ == "__main__":
@@ -115,12 +154,26 @@ if __name__ == "__main__":
         description="Plot components distribution hexbin",
         prog="python -m tools.plots.components_hexbin",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+    add_common_args(parser, raw=False, dbs=False)
+    parser.add_argument(
+        "--points",
+        action="store_true",
+        help="Keep every point and bin them with matplotlib instead of a count grid",
+    )
+    parser.add_argument(
+        "--mesh",
+        action="store_true",
+        help="With --points, pre-bin the points in a mesh instead of handing each one to the "
+        "hexbin",
+    )
     args = parser.parse_args()
+    check_common_args(parser, args)
 
     plot = ComponentsHexbin(
-        DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
+        settings.DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
     )
 
-    plot.output = args.output
-    asyncio.run(plot.plot())
+    apply_common_args(plot, args)
+    plot.keep_points = args.points
+    plot.mesh = args.mesh
+    asyncio.run(plot.plot(args.export))
@@ -1,39 +1,79 @@
 import argparse
 import asyncio
-from pathlib import PurePath
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
 
+import settings
 from settings import *
+from tools.names import match_filter, name_matcher
+from tools.plots import style
+from tools.plots.base import (
+    Plot,
+    add_common_args,
+    apply_common_args,
+    check_common_args,
+    open_source,
+)
+from tools.sketches import ValueCounts
 
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
 
+class NLSRContentSizeDistribution(Plot):
+    BINS = 80
 
-class NLSRContentSizeDistribution:
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self):
-        search_term = "nlsr"
-        content_sizes = []
-
-        LOGGER.info("Getting the packets...")
-        for collection in self.collections.values():
-            async for packet in self.db[collection].find({}, {"_id": 0, "name": 1, "size3": 1}):
-                if search_term in packet["name"]:
-                    content_sizes.append(packet["size3"])
+        super().__init__(db, collections)
+        self.fields = {"DATA": ("name", "size3")}
+        # Substring of the names to keep, or a name prefix when it starts with a slash
+        self.match = "nlsr"
+        self.content_sizes = ValueCounts()
+
+    async def prepare(self):
+        self.content_sizes = ValueCounts()
+
+    def update(self, name, batch):
+        matches = name_matcher(self.match)
+        sizes = batch["size3"]
+        selected = np.fromiter(map(matches, batch["name"]), dtype=bool, count=len(sizes))
+        selected &= sizes >= 0
+        self.content_sizes.update(sizes[selected])
+
+    async def aggregate(self):
+        # One row per distinct size of the matching packets, which is enough for exact bins
+        pipeline = [
+            {"$match": {**match_filter(self.match), "size3": {"$type": "number"}}},
+            {"$group": {"_id": "$size3", "count": {"$sum": 1}}},
+        ]
+        content_sizes = ValueCounts()
+        for row in await self.run_pipeline(self.collections["DATA"], pipeline):
+            content_sizes.counts[row["_id"]] += row["count"]
+        return content_sizes
+
+    async def compute(self):
+        if self.source is not None or self.cache is None:
+            LOGGER.info(f"Aggregating the sizes of the packets matching {self.match!r}...")
+            self.content_sizes = await self.aggregate()
+            return self.tables()
+        return await super().compute()
+
+    def tables(self):
+        # Exact counts of each distinct size, which the histogram bins
+        sizes, counts = self.content_sizes.arrays()
+        return {"sizes": {"size": sizes, "count": counts}}
+
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        style.setup()
+
+        sizes, size_counts = self.content_sizes.arrays()
 
         # Custom: This was done to get the count divided by 10^4 for aesthetic reasons and
         # should not be present for general plots
         LOGGER.info("Preparing the data...")
-        counts, bin_edges = np.histogram(content_sizes, bins=80)
+        counts, bin_edges = np.histogram(
+            sizes, bins=NLSRContentSizeDistribution.BINS, weights=size_counts
+        )
         counts = counts / 10**4
         # End
 
@@ -44,14 +84,13 @@ class NLSRContentSizeDistribution:
 
         # Custom: This was done to get the count divided by 10^4 for aesthetic reasons and
         # should not be present for general plots
-        for i in range(len(bin_edges) - 1):
-            ax.hist(
-                [bin_edges[i]],
-                bins=[bin_edges[i], bin_edges[i + 1]],
-                weights=[counts[i]],
-                color="#4787BB",
-                edgecolor="black",
-            )
+        ax.hist(
+            bin_edges[:-1],
+            bins=bin_edges,
+            weights=counts,
+            color="#4787BB",
+            edgecolor="black",
+        )
         # End
 
         # Uncomment for generic case
@@ -68,12 +107,7 @@ class NLSRContentSizeDistribution:
         ax.tick_params(axis="both", which="minor")
         plt.tight_layout()
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Content size distribution saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Content size distribution")
 
 
 if __name__ == "__main__":
@@ -81,10 +115,23 @@ if __name__ == "__main__":
         description="Plot content size distribution for data packets.",
         prog="python -m tools.plots.content_size_distribution",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+    add_common_args(parser, raw=False)
+    parser.add_argument(
+        "--match",
+        default="nlsr",
+        help="Keep the Data packets whose name contains MATCH, or starts with it when MATCH "
+        "starts with a slash (default: nlsr)",
+    )
     args = parser.parse_args()
+    check_common_args(parser, args)
+
+    plot = NLSRContentSizeDistribution(settings.DB, {"DATA": MONGO_COLLECTION_DATA})
+
+    apply_common_args(plot, args)
+    plot.match = args.match
 
-    plot = NLSRContentSizeDistribution(DB, {"DATA": MONGO_COLLECTION_DATA})
+    async def main():
+        plot.source = await open_source(args)
+        await plot.plot(args.export)
 
-    plot.output = args.output
-    asyncio.run(plot.plot())
+    asyncio.run(main())
@@ -1,19 +1,23 @@
 import argparse
 import asyncio
-from datetime import datetime, timedelta
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import timedelta
 from pathlib import PurePath
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from matplotlib import ticker
 
+import settings
 from settings import *
-
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
+from tools.binning import aggregate_throughput, numpy_throughput
+from tools.plots import style
+from tools.plots.base import add_common_args, apply_common_args
+from tools.render import MAX_VERTICES, decimate
+from tools.rollups import rollup_throughput
+from tools.sources import DataSource
 
 # may 31
 # DBS = [
@@ -39,6 +43,21 @@ DBS = [
 # DBS = ['suns-cs-ucla-edu-2023-06-09T05:00:02Z', 'wundngw-2023-06-09T05:00:11Z',
 #                  'hobo-2023-06-09T05:00:04Z', 'titan-2023-06-09T05:00:40Z']
 
+# Subplot titles for the databases whose name contains the key, other sites show the database name
+SITE_TITLES = {
+    "suns": "UCLA",
+    "wundngw": "WU",
+    "hobo": "ARIZONA",
+    "titan": "MEMPHIS",
+}
+
+
+def site_title(name):
+    for key, title in SITE_TITLES.items():
+        if key in name:
+            return title
+    return name
+
 
 class GridPacketsHistogramThroughput:
     def __init__(self, db, name, collections):
@@ -46,81 +65,54 @@ class GridPacketsHistogramThroughput:
         self.name = name
         self.collections = collections
         self.output = False
+        self.engine = "server"
+        self.cache = None
+        # Process pool for the client-side binning
+        self.executor = None
+        self.rollups = True
+        # DataSource of the site when it has several databases (days), binned together
+        self.source = None
+        # Bound on the vertices drawn per series (see Plot.max_vertices)
+        self.max_vertices = None
+
+    def line(self, x, y):
+        if self.max_vertices is None:
+            return x, y
+        return decimate(x, y, self.max_vertices)
 
     async def plot(self, duration, ax1, ax2):
-        LOGGER.info("Getting the packets...")
-        i_ts = []
-        d_ts = []
-        r_ts = []
-        i_sizes = []
-        d_sizes = []
-        r_sizes = []
-        pipeline = [{"$project": {"_id": 0, "ts": 1, "size2": 1}}, {"$sort": {"ts": 1}}]
-        for collection in self.collections.values():
-            r = self.db[collection].aggregate(pipeline)
-            async for doc in r:
-                if collection == self.collections["INTEREST"]:
-                    i_ts.append(doc["ts"])
-                    i_sizes.append(doc["size2"])
-                elif collection == self.collections["DATA"]:
-                    d_ts.append(doc["ts"])
-                    d_sizes.append(doc["size2"])
-                else:
-                    r_ts.append(doc["ts"])
-                    r_sizes.append(doc["size2"])
-
-        LOGGER.info("Preparing the data...")
-        # Calculate number of packets / bytes in each duration
-        start_time = datetime.utcfromtimestamp(min(i_ts[0], d_ts[0]) / 1e9)
-        end_time = datetime.utcfromtimestamp(max(i_ts[-1], d_ts[-1]) / 1e9)
-        d = int((end_time - start_time).total_seconds())
-        num_durations = min(d // (duration * 60) + 1, 3 * 60 // duration)
-        interest_num_packets = [0] * num_durations
-        interest_ts = [0] * num_durations
-        data_num_packets = [0] * num_durations
-        data_ts = [0] * num_durations
-        interest_throughput = [0] * num_durations
-        data_throughput = [0] * num_durations
-        r_throughput = [0] * num_durations
-
-        def calculate_duration(packet_t):
-            packet_duration = int(
-                (datetime.utcfromtimestamp(packet_t / 1e9) - start_time).total_seconds()
-                // (duration * 60)
-            )
-            return min(packet_duration, num_durations - 1)
-
-        packet_data = [
-            (i_ts, i_sizes, interest_num_packets, interest_ts, interest_throughput),
-            (d_ts, d_sizes, data_num_packets, data_ts, data_throughput),
-            (r_ts, r_sizes, None, None, r_throughput),
-        ]
-        for packets, sizes, num_packets, ts, throughput in packet_data:
-            for packet_t, size in zip(packets, sizes):
-                packet_duration = calculate_duration(packet_t)
-                throughput[packet_duration] += size
-                if num_packets is not None and ts is not None:
-                    num_packets[packet_duration] += 1
-                    ts[packet_duration] = datetime.utcfromtimestamp(packet_t / 1e9)
-        throughput = [
-            t * 8 / (duration * 60) / 1e6
-            for t in (
-                interest_throughput[i] + data_throughput[i] + r_throughput[i]
-                for i in range(num_durations)
+        from matplotlib import ticker
+
+        LOGGER.info(f"Binning the packets of {self.name}...")
+        bins = None
+        if self.rollups and self.source is None:
+            bins = await rollup_throughput(self.db, self.collections, duration)
+        if bins is not None:
+            LOGGER.info(f"Read the bins of {self.name} from the rollups")
+        elif self.source is not None:
+            LOGGER.info(f"Binning {len(self.source)} databases of {self.name} together")
+            bins = await self.source.throughput(self.collections, duration)
+        elif self.engine == "server" and self.cache is None:
+            bins = await aggregate_throughput(self.db, self.collections, duration)
+        else:
+            bins = await numpy_throughput(
+                self.db, self.collections, duration, self.cache, self.executor
             )
-        ]
+        start_time = bins.start_time
+        num_durations = bins.num_durations
+        interest_num_packets = bins.interest_packets
+        data_num_packets = bins.data_packets
+        throughput = bins.throughput
 
         LOGGER.info("Plotting...")
         # First plot
         ax1.plot(
-            np.arange(num_durations),
-            [i / 1000 for i in interest_num_packets],
+            *self.line(np.arange(num_durations), [i / 1000 for i in interest_num_packets]),
             color="#139061",
             label="Interests",
         )
         ax1.plot(
-            np.arange(num_durations),
-            [i / 1000 for i in data_num_packets],
+            *self.line(np.arange(num_durations), [i / 1000 for i in data_num_packets]),
             color="#AC9820",
             label="Data",
         )
@@ -129,19 +121,10 @@ class GridPacketsHistogramThroughput:
         )
         ax1.xaxis.set_major_formatter(xformatter)
         ax1.yaxis.set_major_formatter(ticker.ScalarFormatter())
-        title = None
-        if "suns" in self.name:
-            title = "UCLA"
-        elif "wundngw" in self.name:
-            title = "WU"
-        elif "hobo" in self.name:
-            title = "ARIZONA"
-        elif "titan" in self.name:
-            title = "MEMPHIS"
-        ax1.set_title(title)
+        ax1.set_title(site_title(self.name))
 
         # Second plot
-        ax2.plot(np.arange(num_durations), throughput, color="r", linestyle="-")
+        ax2.plot(*self.line(np.arange(num_durations), throughput), color="r", linestyle="-")
         ax2.xaxis.set_major_formatter(xformatter)
 
         ax1.spines["right"].set_visible(False)
@@ -155,63 +138,151 @@ if __name__ == "__main__":
         description="Plot grid histogram throughput",
         prog="python -m tools.plots.grid_throughput",
     )
+    add_common_args(parser, binning=True, dbs=False, export=False)
     parser.add_argument(
-        "--duration",
-        default=60,
+        "--dbs",
+        nargs="+",
+        default=DBS,
+        metavar="PATTERN",
+        help="Site databases to plot, as names or globs such as '*-2023-06-06T*'. The databases "
+        "of the same site on several days are plotted together. (default: the DBS list)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        default=4,
+        type=int,
+        help="Number of databases fetched at the same time (default: 4)",
+    )
+    parser.add_argument(
+        "--workers",
+        default=os.cpu_count(),
         type=int,
-        help="Duration in minutes to group packets (default: 60)",
+        help="Processes decoding and binning the packets with --engine numpy (default: number of "
+        "CPUs)",
+    )
+    parser.add_argument(
+        "--columns",
+        default=4,
+        type=int,
+        help="Sites per row of the grid (default: 4)",
+    )
+    parser.add_argument(
+        "--max-vertices",
+        nargs="?",
+        const=MAX_VERTICES,
+        type=int,
+        metavar="N",
+        help="Decimate each series to about N vertices, keeping the peaks "
+        f"(default: {MAX_VERTICES})",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
     args = parser.parse_args()
 
-    sns.set_context("paper", font_scale=1.5)
-    fig, axs = plt.subplots(2, 4, figsize=(18, 6), sharex=True, sharey="row")
-    tasks = []
-    for ax in axs.flat:
-        ax.tick_params(axis="both", which="major")
-        ax.tick_params(axis="both", which="minor")
-        for tick in ax.yaxis.get_major_ticks():
-            tick.label1.set_visible(True)
-
     async def main():
-        for i, db in enumerate(DBS):
-            plot = GridPacketsHistogramThroughput(
-                DB_CLIENT[db],
-                db,
-                {
-                    "INTEREST": MONGO_COLLECTION_INTEREST,
-                    "DATA": MONGO_COLLECTION_DATA,
-                    "NACK": MONGO_COLLECTION_NACK,
-                    "FRAGMENT": MONGO_COLLECTION_FRAGMENT,
-                },
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib import ticker
+
+        style.setup()
+
+        source = await DataSource.matching(settings.DB_CLIENT, args.dbs, args.concurrency)
+        if not len(source):
+            LOGGER.error("Error: No site database to plot.")
+            exit(1)
+        sites = source.by_site()
+        LOGGER.info(
+            f"Plotting {len(sites)} sites from {len(source)} databases: "
+            f"{', '.join(source.databases)}"
+        )
+
+        # Each site is a column of a packets plot above a throughput plot
+        columns = min(args.columns, len(sites))
+        rows = math.ceil(len(sites) / columns)
+        sns.set_context("paper", font_scale=1.5)
+        fig, axs = plt.subplots(
+            2 * rows,
+            columns,
+            figsize=(4.5 * columns, 6 * rows),
+            sharex=True,
+            sharey="row",
+            squeeze=False,
+        )
+        packet_axs = axs[0::2]
+        mbps_axs = axs[1::2]
+        for ax in axs.flat:
+            ax.tick_params(axis="both", which="major")
+            ax.tick_params(axis="both", which="minor")
+            for tick in ax.yaxis.get_major_ticks():
+                tick.label1.set_visible(True)
+        for i in range(len(sites), rows * columns):
+            packet_axs.flat[i].set_visible(False)
+            mbps_axs.flat[i].set_visible(False)
+
+        collections = {
+            "INTEREST": MONGO_COLLECTION_INTEREST,
+            "DATA": MONGO_COLLECTION_DATA,
+            "NACK": MONGO_COLLECTION_NACK,
+            "FRAGMENT": MONGO_COLLECTION_FRAGMENT,
+        }
+
+        async def plot_site(plot, ax1, ax2):
+            # The databases of a site with several days take the slots of the source one by one
+            if plot.source is not None:
+                await plot.plot(args.duration, ax1, ax2)
+                return
+            async with source.slots:
+                await plot.plot(args.duration, ax1, ax2)
+
+        # The workers decode and bin the packets read from the database with --engine numpy
+        pool = nullcontext()
+        if args.engine == "numpy" and not args.cache:
+            # Started from a fork server, like the workers of tools.plots.batch
+            pool = ProcessPoolExecutor(
+                args.workers, mp_context=multiprocessing.get_context("forkserver")
             )
-            tasks.append(asyncio.create_task(plot.plot(args.duration, axs[0, i], axs[1, i])))
-        await asyncio.gather(*tasks)
+        with pool as executor:
+            tasks = []
+            for i, (site, site_source) in enumerate(sites.items()):
+                plot = GridPacketsHistogramThroughput(
+                    settings.DB_CLIENT[site_source.databases[0]], site, collections
+                )
+                if len(site_source) > 1:
+                    plot.source = site_source
+                apply_common_args(plot, args)
+                plot.executor = executor
+                plot.max_vertices = args.max_vertices
+                tasks.append(plot_site(plot, packet_axs.flat[i], mbps_axs.flat[i]))
+            await asyncio.gather(*tasks)
 
         # Create a common legend for all subplots
         handles, labels = axs[0, 0].get_legend_handles_labels()
         fig.legend(handles, labels, loc="upper right")
-        axs[0, 0].set_ylabel(r"Packets/min (x$10^3$)")
 
         # Custom: This was added to display y-ticks at every 10 units for packets/min plot and
         # should not be present for general plots
         y_ticks_interval_packets = 10
-        max_y_value_packets = max([ax.get_ylim()[1] for ax in axs[0]])
-        axs[0, 0].set_yticks(
-            np.arange(0, max_y_value_packets + y_ticks_interval_packets, y_ticks_interval_packets)
-        )
+        max_y_value_packets = max([ax.get_ylim()[1] for ax in packet_axs.flat])
+        for row in packet_axs:
+            row[0].set_yticks(
+                np.arange(
+                    0, max_y_value_packets + y_ticks_interval_packets, y_ticks_interval_packets
+                )
+            )
         # Custom: End
 
         # Custom: This was added to display y-ticks at every 10 units for mbps plot and
         # should not be present for general plots
         y_ticks_interval_mbps = 10
-        max_y_value_mbps = max([ax.get_ylim()[1] for ax in axs[1]])
-        axs[1, 0].set_yticks(
-            np.arange(0, max_y_value_mbps + y_ticks_interval_mbps, y_ticks_interval_mbps)
-        )
+        max_y_value_mbps = max([ax.get_ylim()[1] for ax in mbps_axs.flat])
+        for row in mbps_axs:
+            row[0].set_yticks(
+                np.arange(0, max_y_value_mbps + y_ticks_interval_mbps, y_ticks_interval_mbps)
+            )
         # Custom: End
 
-        axs[1, 0].set_ylabel("Mbps")
+        for row in packet_axs:
+            row[0].set_ylabel(r"Packets/min (x$10^3$)")
+        for row in mbps_axs:
+            row[0].set_ylabel("Mbps")
         for ax in axs.flat:
             ax.set_ylim(bottom=0)
             # Custom: This was added to display x-ticks at exact hour intervals and
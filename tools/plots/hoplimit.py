@@ -1,39 +1,83 @@
 import argparse
 import asyncio
-from pathlib import PurePath
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from matplotlib import ticker
 
+import settings
 from settings import *
-
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
-
-
-class HopLimit:
+from tools.plots import style
+from tools.plots.base import (
+    Plot,
+    add_common_args,
+    apply_common_args,
+    check_common_args,
+    open_source,
+)
+from tools.rollups import rollup_values
+
+
+class HopLimit(Plot):
     DEFAULT_HOPLIMIT = 255
 
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self):
-        LOGGER.info("Getting packets....")
-        hoplimits = []
-        for _, collection in self.collections.items():
-            async for document in self.db[collection].find({}, {"hopLimit": 1, "_id": 0}):
-                if document.get("hopLimit"):
-                    hoplimits.append(document.get("hopLimit"))
-
-        counts = {}
-        for hoplimit in hoplimits:
-            counts[hoplimit] = counts.get(hoplimit, 0) + 1
+        super().__init__(db, collections)
+        self.fields = {"INTEREST": ("hopLimit",)}
+        self.counts = {}
+
+    async def prepare(self):
+        self.counts = {}
+
+    def update(self, name, batch):
+        # Missing and zero hop limits are left out
+        hop_limits = batch["hopLimit"]
+        values, counts = np.unique(hop_limits[hop_limits > 0], return_counts=True)
+        for hoplimit, count in zip(values.tolist(), counts.tolist()):
+            self.counts[hoplimit] = self.counts.get(hoplimit, 0) + count
+
+    async def aggregate(self):
+        # At most one row per hop limit, missing and zero hop limits do not match
+        pipeline = [
+            {"$match": {"hopLimit": {"$gt": 0}}},
+            {"$group": {"_id": "$hopLimit", "count": {"$sum": 1}}},
+        ]
+        rows = await self.run_pipeline(self.collections["INTEREST"], pipeline)
+        return {row["_id"]: row["count"] for row in rows}
+
+    async def from_rollups(self):
+        counts = await rollup_values(self.db, self.collections["INTEREST"], "hopLimit")
+        if counts is None:
+            return False
+        self.counts = {
+            hoplimit: count for hoplimit, count in counts.items() if hoplimit and hoplimit > 0
+        }
+        return True
+
+    async def compute(self):
+        LOGGER.info("Counting the hop limits...")
+        if self.source is None and self.rollups and await self.from_rollups():
+            return self.tables()
+        if self.source is not None or self.cache is None:
+            self.counts = await self.aggregate()
+            return self.tables()
+        return await super().compute()
+
+    def tables(self):
+        hop_limits = sorted(self.counts)
+        return {
+            "hop_limits": {
+                "hop_limit": np.array(hop_limits, dtype=np.int64),
+                "count": np.array([self.counts[h] for h in hop_limits], dtype=np.int64),
+            }
+        }
+
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib import ticker
+
+        style.setup()
+
+        counts = self.counts
 
         LOGGER.info("Plotting...")
         sns.set_context("paper", font_scale=3)
@@ -59,22 +103,23 @@ class HopLimit:
         ax.grid(axis="y")
         fig.tight_layout()
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Hop limit saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Hop limit")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
         description="Plot hop limit CDF", prog="python -m tools.plots.hoplimit"
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+    add_common_args(parser)
     args = parser.parse_args()
+    check_common_args(parser, args)
+
+    plot = HopLimit(settings.DB, {"INTEREST": MONGO_COLLECTION_INTEREST})
+
+    apply_common_args(plot, args)
 
-    plot = HopLimit(DB, {"INTEREST": MONGO_COLLECTION_INTEREST})
+    async def main():
+        plot.source = await open_source(args)
+        await plot.plot(args.export)
 
-    plot.output = args.output
-    asyncio.run(plot.plot())
+    asyncio.run(main())
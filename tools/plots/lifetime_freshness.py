@@ -1,53 +1,128 @@
 import argparse
 import asyncio
-from pathlib import PurePath
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from matplotlib import ticker
 
+import settings
 from settings import *
+from tools.columns import MISSING
+from tools.plots import style
+from tools.plots.base import Plot, add_common_args, apply_common_args, check_common_args
+from tools.render import MAX_VERTICES, bound_steps
+from tools.rollups import rollup_values
+from tools.sketches import ValueCounts
 
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
 
-
-class LifetimeFreshnessCDF:
+class LifetimeFreshnessCDF(Plot):
     DEFAULT_LIFETIME = 4000
     DEFAULT_FRESHNESS = 0
 
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self):
-        LOGGER.info("Getting the packets...")
-        interest_lifetime_values = []
-        data_freshness_values = []
-        for collection_name, collection in self.collections.items():
-            async for document in self.db[collection].find(
-                {}, {"lifetime": 1, "freshness": 1, "_id": 0}
-            ):
-                if collection_name == "INTEREST":
-                    interest_lifetime_values.append(
-                        document.get("lifetime", LifetimeFreshnessCDF.DEFAULT_LIFETIME)
-                    )
-                elif collection_name == "DATA":
-                    if document.get("freshness"):
-                        data_freshness_values.append(document.get("freshness"))
-
-        interest_lifetime_values.sort()
-        data_freshness_values.sort()
+        super().__init__(db, collections)
+        self.fields = {"INTEREST": ("lifetime",), "DATA": ("freshness",)}
+        # Keep every value and draw one vertex per packet instead of counting the distinct values
+        self.keep_points = False
+        self.interest_lifetime_values = []
+        self.data_freshness_values = []
+        self.interest_lifetime_counts = ValueCounts()
+        self.data_freshness_counts = ValueCounts()
+
+    async def prepare(self):
+        self.interest_lifetime_values = []
+        self.data_freshness_values = []
+        self.interest_lifetime_counts = ValueCounts()
+        self.data_freshness_counts = ValueCounts()
+
+    def update(self, name, batch):
+        if name == "INTEREST":
+            lifetimes = batch["lifetime"]
+            lifetimes = np.where(
+                lifetimes == MISSING, LifetimeFreshnessCDF.DEFAULT_LIFETIME, lifetimes
+            )
+            if self.keep_points:
+                self.interest_lifetime_values.extend(lifetimes.tolist())
+            else:
+                self.interest_lifetime_counts.update(lifetimes)
+        elif name == "DATA":
+            freshness = batch["freshness"]
+            # Missing and zero freshness periods are left out
+            freshness = freshness[freshness > 0]
+            if self.keep_points:
+                self.data_freshness_values.extend(freshness.tolist())
+            else:
+                self.data_freshness_counts.update(freshness)
+
+    async def from_rollups(self):
+        if self.keep_points:
+            return False
+        lifetimes = await rollup_values(self.db, self.collections["INTEREST"], "lifetime")
+        freshness = await rollup_values(self.db, self.collections["DATA"], "freshness")
+        if lifetimes is None or freshness is None:
+            return False
+        for lifetime, count in lifetimes.items():
+            if lifetime is None:
+                lifetime = LifetimeFreshnessCDF.DEFAULT_LIFETIME
+            self.interest_lifetime_counts.counts[lifetime] += count
+        for value, count in freshness.items():
+            if value and value > 0:
+                self.data_freshness_counts.counts[value] += count
+        return True
+
+    def cdfs(self):
+        cdfs = self.exact_cdfs()
+        if self.max_vertices is None:
+            return cdfs
+        return tuple(bound_steps(values, cdf, self.max_vertices) for values, cdf in cdfs)
+
+    def exact_cdfs(self):
+        if not self.keep_points:
+            return self.interest_lifetime_counts.cdf(), self.data_freshness_counts.cdf()
+        interest_lifetime_values = sorted(self.interest_lifetime_values)
+        data_freshness_values = sorted(self.data_freshness_values)
         interest_lifetime_cdf = np.arange(1, len(interest_lifetime_values) + 1) / len(
             interest_lifetime_values
         )
         data_freshness_cdf = np.arange(1, len(data_freshness_values) + 1) / len(
             data_freshness_values
         )
+        return (
+            (interest_lifetime_values, interest_lifetime_cdf),
+            (data_freshness_values, data_freshness_cdf),
+        )
+
+    def value_counts(self):
+        if not self.keep_points:
+            return self.interest_lifetime_counts, self.data_freshness_counts
+        interest_lifetime_counts = ValueCounts()
+        data_freshness_counts = ValueCounts()
+        interest_lifetime_counts.update(np.array(self.interest_lifetime_values, dtype=np.int64))
+        data_freshness_counts.update(np.array(self.data_freshness_values, dtype=np.int64))
+        return interest_lifetime_counts, data_freshness_counts
+
+    def tables(self):
+        # Count of each distinct value and the CDF at that value
+        tables = {}
+        for table, value_counts in zip(("lifetime", "freshness"), self.value_counts()):
+            values, counts = value_counts.arrays()
+            ends = np.cumsum(counts)
+            tables[table] = {
+                "value": values,
+                "count": counts,
+                "cdf": ends / ends[-1] if len(ends) else np.array([]),
+            }
+        return tables
+
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib import ticker
+
+        style.setup()
+
+        (
+            (interest_lifetime_values, interest_lifetime_cdf),
+            (data_freshness_values, data_freshness_cdf),
+        ) = self.cdfs()
 
         LOGGER.info("Plotting...")
         sns.set_context("paper", font_scale=3)
@@ -88,12 +163,7 @@ class LifetimeFreshnessCDF:
         ax.tick_params(axis="both", which="minor")
         fig.tight_layout()
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Lifetimefreshness cdf saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Lifetimefreshness cdf")
 
 
 if __name__ == "__main__":
@@ -101,12 +171,29 @@ if __name__ == "__main__":
         description="Plot interest lifetime cdf",
         prog="python -m tools.plots.lifetime_freshness",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+    add_common_args(parser, dbs=False)
+    parser.add_argument(
+        "--points",
+        action="store_true",
+        help="Draw one vertex per packet instead of one per distinct value",
+    )
+    parser.add_argument(
+        "--max-vertices",
+        nargs="?",
+        const=MAX_VERTICES,
+        type=int,
+        metavar="N",
+        help="Draw each CDF with at most about N vertices, merging the steps smaller than 2/N "
+        f"(default: {MAX_VERTICES})",
+    )
     args = parser.parse_args()
+    check_common_args(parser, args)
 
     plot = LifetimeFreshnessCDF(
-        DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
+        settings.DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
     )
 
-    plot.output = args.output
-    asyncio.run(plot.plot())
+    apply_common_args(plot, args)
+    plot.keep_points = args.points
+    plot.max_vertices = args.max_vertices
+    asyncio.run(plot.plot(args.export))
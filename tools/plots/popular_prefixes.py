@@ -1,57 +1,202 @@
 import argparse
 import asyncio
-from collections import Counter
-from pathlib import PurePath
+from collections import Counter, defaultdict
 
-import matplotlib
-import matplotlib.pyplot as plt
-import seaborn as sns
-from ndn.encoding import Name
+import numpy as np
 
+import settings
 from settings import *
+from tools.names import PREFIX_LEVELS, PrefixTrie, name_prefixes, name_uri
+from tools.plots import style
+from tools.plots.base import (
+    Plot,
+    add_common_args,
+    apply_common_args,
+    check_common_args,
+    open_source,
+)
+from tools.rollups import rollup_top_prefixes
+from tools.sketches import SpaceSaving
 
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
 
+class PopularPrefixes(Plot):
+    TOP = 3
+    MODES = ("approx", "exact", "trie", "server")
 
-class PopularPrefixes:
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self):
-        LOGGER.info("Getting the packets...")
-        prefix_counters_interests = {}
-        prefix_counters_data = {}
-
-        for collection in self.collections.values():
-            async for document in self.db[collection].find({}, {"_id": 0, "name": 1}):
-                name_components = document["name"].split("/")[1:]
-
-                for i in range(1, min(len(name_components), 5) + 1):  # Limit to first 5 levels
-                    prefix = "/" + "/".join(name_components[:i])
-                    level = i
-
-                    if collection == self.collections["INTEREST"]:
-                        if level not in prefix_counters_interests:
-                            prefix_counters_interests[level] = Counter()
-                        prefix_counters_interests[level][prefix] += 1
-                    elif collection == self.collections["DATA"]:
-                        if level not in prefix_counters_data:
-                            prefix_counters_data[level] = Counter()
-                        prefix_counters_data[level][prefix] += 1
-
-        # Get top 3 prefixes by count for each level for interests
+        super().__init__(db, collections)
+        self.fields = {"INTEREST": ("name",), "DATA": ("name",)}
+        # approx: Space-Saving counters, exact: Counter of prefix strings, trie: exact counts in a
+        # component-interned trie, server: MongoDB aggregation
+        self.mode = "approx"
+        # Approximate counters: relative error bound and optional fixed number of entries
+        self.error = 0.001
+        self.capacity = None
+        self.compare = False
+        self.prefix_counters = {}
+        self.exact_counters = {}
+        self.tries = {}
+        self.top_prefixes = {}
+
+    def _new_counter(self):
+        if self.mode == "exact":
+            return Counter()
+        if self.capacity:
+            return SpaceSaving(self.capacity)
+        return SpaceSaving.from_error(self.error)
+
+    async def prepare(self):
+        self.prefix_counters = {
+            name: defaultdict(self._new_counter) for name in ("INTEREST", "DATA")
+        }
+        self.exact_counters = {name: defaultdict(Counter) for name in ("INTEREST", "DATA")}
+        self.tries = {name: PrefixTrie() for name in ("INTEREST", "DATA")}
+
+    def update(self, name, batch):
+        if self.mode == "trie":
+            self.tries[name].update(batch["name"])
+            return
+
+        # Limit to first 5 levels
+        prefixes_per_level = defaultdict(list)
+        for packet_name in batch["name"]:
+            for level, prefix in enumerate(name_prefixes(packet_name), start=1):
+                prefixes_per_level[level].append(prefix)
+        for level, prefixes in prefixes_per_level.items():
+            self.prefix_counters[name][level].update(prefixes)
+            if self.compare and self.mode == "approx":
+                self.exact_counters[name][level].update(prefixes)
+
+    def finish(self):
+        # Get top 3 prefixes by count for each level
         LOGGER.info("Getting the top prefixes...")
-        top_prefixes_interests_per_level = {
-            level: counter.most_common(3) for level, counter in prefix_counters_interests.items()
+        if self.mode == "trie":
+            self.top_prefixes = {
+                name: {
+                    level: trie.most_common(level, PopularPrefixes.TOP)
+                    for level in range(1, PREFIX_LEVELS + 1)
+                }
+                for name, trie in self.tries.items()
+            }
+        else:
+            self.top_prefixes = {
+                name: {
+                    level: counter.most_common(PopularPrefixes.TOP)
+                    for level, counter in counters.items()
+                }
+                for name, counters in self.prefix_counters.items()
+            }
+
+        if self.compare and self.mode == "approx":
+            self.report()
+
+    def report(self):
+        LOGGER.info(f"Approximate top-{PopularPrefixes.TOP} prefixes compared to the exact counts:")
+        for name in ("INTEREST", "DATA"):
+            for level in sorted(self.exact_counters[name]):
+                sketch = self.prefix_counters[name][level]
+                counter = self.exact_counters[name][level]
+                approx = sketch.most_common(PopularPrefixes.TOP)
+                exact = counter.most_common(PopularPrefixes.TOP)
+                same = [p for p, _ in approx] == [p for p, _ in exact]
+                LOGGER.info(
+                    f"{name} L{level}: {'match' if same else 'MISMATCH'}, "
+                    f"{len(sketch)} of {len(counter)} prefixes tracked, "
+                    f"error bound {sketch.error_bound:.0f}"
+                )
+                for (a_prefix, a_count), (e_prefix, e_count) in zip(approx, exact):
+                    LOGGER.info(
+                        f"  {a_prefix} {a_count} (+{sketch.error(a_prefix)})"
+                        f" | {e_prefix} {e_count}"
+                    )
+
+    async def aggregate(self, collection):
+        # Per-level prefix counts with a single scan: the first 5 components of each name are
+        # grouped once per level in a $facet
+        pipeline = [
+            {
+                "$project": {
+                    "_id": 0,
+                    "components": {"$slice": [{"$split": ["$name", "/"]}, 1, PREFIX_LEVELS]},
+                }
+            },
+            {
+                "$facet": {
+                    str(level): [
+                        {"$match": {f"components.{level - 1}": {"$exists": True}}},
+                        {
+                            "$group": {
+                                "_id": {"$slice": ["$components", level]},
+                                "count": {"$sum": 1},
+                            }
+                        },
+                        {"$sort": {"count": -1, "_id": 1}},
+                        {"$limit": PopularPrefixes.TOP},
+                    ]
+                    for level in range(1, PREFIX_LEVELS + 1)
+                }
+            },
+        ]
+        top_prefixes = {}
+        for result in await self.run_pipeline(collection, pipeline, allowDiskUse=True):
+            for level, rows in result.items():
+                top_prefixes[int(level)] = [
+                    ("/" + "/".join(row["_id"]), row["count"]) for row in rows
+                ]
+        return top_prefixes
+
+    async def from_rollups(self):
+        # The rollups hold exact counts, so they cannot be compared to the sketches
+        if self.compare:
+            return False
+        top_prefixes = {}
+        for name in ("INTEREST", "DATA"):
+            top = await rollup_top_prefixes(self.db, self.collections[name], PopularPrefixes.TOP)
+            if top is None:
+                return False
+            top_prefixes[name] = top
+        self.top_prefixes = top_prefixes
+        return True
+
+    async def compute(self):
+        if self.mode != "server":
+            return await super().compute()
+        if self.source is None and self.rollups and await self.from_rollups():
+            return self.tables()
+        LOGGER.info("Aggregating the prefixes...")
+        self.top_prefixes = {
+            name: await self.aggregate(self.collections[name]) for name in ("INTEREST", "DATA")
         }
-        top_prefixes_data_per_level = {
-            level: counter.most_common(3) for level, counter in prefix_counters_data.items()
+        return self.tables()
+
+    def tables(self):
+        # One row per top prefix of each packet type and level
+        rows = [
+            (name, level, rank, prefix, count)
+            for name, levels in self.top_prefixes.items()
+            for level, top in sorted(levels.items())
+            for rank, (prefix, count) in enumerate(top, start=1)
+        ]
+        packets, levels, ranks, prefixes, counts = zip(*rows) if rows else ([],) * 5
+        return {
+            "prefixes": {
+                "packet": np.array(packets, dtype=object),
+                "level": np.array(levels, dtype=np.int64),
+                "rank": np.array(ranks, dtype=np.int64),
+                "prefix": np.array(prefixes, dtype=object),
+                "count": np.array(counts, dtype=np.int64),
+            }
         }
 
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+
+        style.setup()
+
+        top_prefixes_interests_per_level = self.top_prefixes["INTEREST"]
+        top_prefixes_data_per_level = self.top_prefixes["DATA"]
+
         LOGGER.info("Plotting...")
         sns.set_context("paper", font_scale=2.5)
         fig, ax = plt.subplots(2, 1, figsize=(16, 14))
@@ -85,7 +230,7 @@ class PopularPrefixes:
                     color=color,
                 )
 
-                prefix = Name.to_str(Name.from_str(prefix))
+                prefix = name_uri(prefix)
                 y_ticks_interests.append(y_pos)
                 y_ticks_labels_interests.append(prefix)
 
@@ -100,7 +245,7 @@ class PopularPrefixes:
                     color=color,
                 )
 
-                prefix = Name.to_str(Name.from_str(prefix))
+                prefix = name_uri(prefix)
                 y_ticks_data.append(y_pos)
                 y_ticks_labels_data.append(prefix)
 
@@ -129,12 +274,7 @@ class PopularPrefixes:
 
         fig.tight_layout()
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Popular prefixes saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Popular prefixes")
 
 
 if __name__ == "__main__":
@@ -142,12 +282,64 @@ if __name__ == "__main__":
         description="Plot NDN packet statistics.",
         prog="python -m tools.plots.popular_prefixes",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
+    add_common_args(parser)
+    parser.add_argument(
+        "--mode",
+        default="approx",
+        choices=PopularPrefixes.MODES,
+        help="Count with bounded-memory sketches (approx), exact string counters (exact), an "
+        "exact component trie (trie) or a MongoDB aggregation (server) (default: approx)",
+    )
+    parser.add_argument(
+        "--exact",
+        dest="mode",
+        action="store_const",
+        const="exact",
+        help="Same as --mode exact",
+    )
+    parser.add_argument(
+        "--error",
+        default=0.001,
+        type=float,
+        help="Count error bound of the approximate counters as a fraction of the packets "
+        "(default: 0.001)",
+    )
+    parser.add_argument(
+        "--capacity",
+        type=int,
+        help="Fixed number of prefixes tracked per level, overrides --error",
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Also count exactly and report how the approximate top prefixes compare",
+    )
+    parser.add_argument(
+        "--overfetch",
+        type=int,
+        metavar="K",
+        help=f"With --dbs, read only the top K x {PopularPrefixes.TOP} prefixes per level of each "
+        "database instead of every prefix. The merged counts are then approximate and their "
+        "error bound is logged.",
+    )
     args = parser.parse_args()
+    check_common_args(parser, args)
 
     plot = PopularPrefixes(
-        DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
+        settings.DB, {"INTEREST": MONGO_COLLECTION_INTEREST, "DATA": MONGO_COLLECTION_DATA}
     )
 
-    plot.output = args.output
-    asyncio.run(plot.plot())
+    apply_common_args(plot, args)
+    plot.mode = args.mode
+    plot.error = args.error
+    plot.capacity = args.capacity
+    plot.compare = args.compare
+
+    async def main():
+        plot.source = await open_source(args)
+        if plot.source is not None:
+            plot.mode = "server"
+            plot.source.overfetch = args.overfetch
+        await plot.plot(args.export)
+
+    asyncio.run(main())
@@ -0,0 +1,11 @@
+def setup(backend=None):
+    # Shared by every plot: fonts are embedded as TrueType (Type 42) in the PDF and PS output.
+    # Batch rendering passes the non-interactive Agg backend. matplotlib, and seaborn even more so,
+    # take most of the startup time of the scripts, so the plots import them when they draw and
+    # call this first.
+    import matplotlib
+
+    matplotlib.rcParams["pdf.fonttype"] = 42
+    matplotlib.rcParams["ps.fonttype"] = 42
+    if backend is not None:
+        matplotlib.use(backend)
@@ -1,106 +1,190 @@
 import argparse
 import asyncio
-from datetime import datetime, timedelta
-from pathlib import PurePath
+from datetime import timedelta
 
-import matplotlib
-import matplotlib.pyplot as plt
 import numpy as np
-import seaborn as sns
-from matplotlib import ticker
 
+import settings
 from settings import *
+from tools.binning import (
+    aggregate_bins,
+    aggregate_throughput,
+    create_binner,
+    numpy_throughput,
+    parse_time,
+    scan_bins,
+    ts_bound,
+    ts_bounds,
+    ts_mask,
+)
+from tools.plots import style
+from tools.plots.base import (
+    Plot,
+    add_common_args,
+    apply_common_args,
+    check_common_args,
+    open_source,
+    scan_plots,
+)
+from tools.render import MAX_VERTICES
+from tools.rollups import rollup_throughput
 
-# For embedded fonts
-matplotlib.rcParams["pdf.fonttype"] = 42
-matplotlib.rcParams["ps.fonttype"] = 42
 
-
-class PacketsHistogramThroughput:
+class PacketsHistogramThroughput(Plot):
     def __init__(self, db, collections):
-        self.db = db
-        self.collections = collections
-        self.output = False
-
-    async def plot(self, duration):
-        LOGGER.info("Getting the packets...")
-        i_ts = []
-        d_ts = []
-        r_ts = []
-        i_sizes = []
-        d_sizes = []
-        r_sizes = []
-        pipeline = [
-            {"$project": {"_id": 0, "ts": 1, "size2": 1}},
-            {"$sort": {"ts": 1}},
-        ]
-        for collection in self.collections.values():
-            r = self.db[collection].aggregate(pipeline)
-            async for doc in r:
-                if collection == self.collections["INTEREST"]:
-                    i_ts.append(doc["ts"])
-                    i_sizes.append(doc["size2"])
-                elif collection == self.collections["DATA"]:
-                    d_ts.append(doc["ts"])
-                    d_sizes.append(doc["size2"])
-                else:
-                    r_ts.append(doc["ts"])
-                    r_sizes.append(doc["size2"])
-
-        LOGGER.info("Preparing the data...")
-        # Calculate number of packets / bytes in each duration
-        start_time = datetime.utcfromtimestamp(min(i_ts[0], d_ts[0]) / 1e9)
-        end_time = datetime.utcfromtimestamp(max(i_ts[-1], d_ts[-1]) / 1e9)
-        d = int((end_time - start_time).total_seconds())
-        num_durations = min(d // (duration * 60) + 1, 3 * 60 // duration)
-        interest_num_packets = [0] * num_durations
-        interest_ts = [0] * num_durations
-        data_num_packets = [0] * num_durations
-        data_ts = [0] * num_durations
-        interest_throughput = [0] * num_durations
-        data_throughput = [0] * num_durations
-        r_throughput = [0] * num_durations
-
-        def calculate_duration(packet_t):
-            packet_duration = int(
-                (datetime.utcfromtimestamp(packet_t / 1e9) - start_time).total_seconds()
-                // (duration * 60)
+        super().__init__(db, collections)
+        self.fields = {name: ("ts", "size2") for name in ("INTEREST", "DATA", "NACK", "FRAGMENT")}
+        self.engine = "server"
+        self.duration = 60
+        # Time range in nanoseconds, None for the whole collections
+        self.since = None
+        self.until = None
+        self.binner = None
+        self.bins = None
+        # Last timestamp binned from each collection when following
+        self.last_ts = {}
+
+    def windowed(self):
+        return self.since is not None or self.until is not None
+
+    async def window_binner(self):
+        # Bins of the since/until window, or of the whole collections
+        return await create_binner(self.db, self.collections, self.duration, self.since, self.until)
+
+    async def prepare(self):
+        self.binner = await self.window_binner()
+
+    def update(self, name, batch):
+        ts, sizes = batch["ts"], batch["size2"]
+        if self.windowed():
+            # A shared scan reads the whole collections, only the packets of the window are binned
+            keep = ts_mask(ts, self.since, self.until)
+            ts, sizes = ts[keep], sizes[keep]
+        self.binner.add(name, ts, sizes)
+
+    def finish(self):
+        self.bins = self.binner.result()
+
+    async def from_rollups(self):
+        self.bins = await rollup_throughput(
+            self.db, self.collections, self.duration, self.since, self.until
+        )
+        return self.bins is not None
+
+    async def compute(self):
+        duration = self.duration
+        LOGGER.info("Binning the packets...")
+        if self.source is not None:
+            self.bins = await self.source.throughput(
+                self.collections, duration, self.since, self.until
+            )
+        elif self.rollups and await self.from_rollups():
+            LOGGER.info("Read the bins from the rollups")
+        elif self.engine == "server" and self.cache is None:
+            self.bins = await aggregate_throughput(
+                self.db, self.collections, duration, self.since, self.until
             )
-            return min(packet_duration, num_durations - 1)
-
-        packet_data = [
-            (i_ts, i_sizes, interest_num_packets, interest_ts, interest_throughput),
-            (d_ts, d_sizes, data_num_packets, data_ts, data_throughput),
-            (r_ts, r_sizes, None, None, r_throughput),
-        ]
-        for packets, sizes, num_packets, ts, throughput in packet_data:
-            for packet_t, size in zip(packets, sizes):
-                packet_duration = calculate_duration(packet_t)
-                throughput[packet_duration] += size
-                if num_packets is not None and ts is not None:
-                    num_packets[packet_duration] += 1
-                    ts[packet_duration] = datetime.utcfromtimestamp(packet_t / 1e9)
-        throughput = [
-            t * 8 / (duration * 60) / 1e6
-            for t in (
-                interest_throughput[i] + data_throughput[i] + r_throughput[i]
-                for i in range(num_durations)
+        elif self.windowed():
+            # Time ranges are read with the ts index instead of the cache
+            self.bins = await numpy_throughput(
+                self.db, self.collections, duration, since=self.since, until=self.until
             )
-        ]
+        else:
+            # Cached columns are always binned client-side
+            await scan_plots(self.db, self.collections, [self], self.cache)
+        return self.tables()
+
+    def tables(self):
+        bins = self.bins
+        starts = np.datetime64(bins.start_time) + np.arange(bins.num_durations) * np.timedelta64(
+            self.duration, "m"
+        )
+        return {
+            "bins": {
+                "start": starts,
+                "interest_packets": np.asarray(bins.interest_packets, dtype=np.int64),
+                "data_packets": np.asarray(bins.data_packets, dtype=np.int64),
+                "bytes": np.asarray(bins.bytes, dtype=np.int64),
+                "mbps": np.asarray(bins.throughput, dtype=np.float64),
+            }
+        }
+
+    async def refresh(self):
+        # Bins the packets newer than the last timestamp seen in each collection, so each refresh
+        # reads only the new documents. Documents inserted later with an older timestamp are
+        # not counted.
+        if self.binner is None:
+            try:
+                self.binner = await self.window_binner()
+            except ValueError:
+                return False
+        found = False
+        for name, collection in self.collections.items():
+            bounds = ts_bounds(self.since, self.until)
+            if name in self.last_ts:
+                bounds["$gt"] = self.last_ts[name]
+            newest = await ts_bound(self.db, collection, -1, bounds)
+            if newest is None:
+                continue
+            bounds["$lte"] = newest
+            self.binner.extend(self.binner.bin_index(newest) + 1)
+            if self.engine == "server":
+                await aggregate_bins(self.binner, self.db, name, collection, bounds)
+            else:
+                await scan_bins(self.binner, self.db, {name: collection}, bounds=bounds)
+            self.last_ts[name] = newest
+            found = True
+        return found
+
+    async def follow(self, duration, interval):
+        import matplotlib.pyplot as plt
+
+        style.setup()
+
+        self.duration = duration
+        self.binner = None
+        self.last_ts = {}
+        if not self.output:
+            plt.ion()
+        while True:
+            LOGGER.info("Binning the new packets...")
+            if await self.refresh():
+                self.bins = self.binner.result()
+                plt.close("all")
+                self.render()
+            else:
+                LOGGER.info("No new packets")
+            if self.output:
+                await asyncio.sleep(interval)
+            else:
+                plt.pause(interval)
+
+    def render(self):
+        import matplotlib.pyplot as plt
+        import seaborn as sns
+        from matplotlib import ticker
+
+        style.setup()
+
+        bins = self.bins
+        duration = self.duration
+        start_time = bins.start_time
+        num_durations = bins.num_durations
+        interest_num_packets = bins.interest_packets
+        data_num_packets = bins.data_packets
+        throughput = bins.throughput
 
         LOGGER.info("Plotting...")
         sns.set_context("paper", font_scale=1.5)
         fig, (ax1, ax2) = plt.subplots(nrows=2, ncols=1, figsize=(8, 8))
         # First plot
         ax1.plot(
-            np.arange(num_durations),
-            [i / 1000 for i in interest_num_packets],
+            *self.line(np.arange(num_durations), [i / 1000 for i in interest_num_packets]),
             color="#139061",
             label="Interests",
         )
         ax1.plot(
-            np.arange(num_durations),
-            [i / 1000 for i in data_num_packets],
+            *self.line(np.arange(num_durations), [i / 1000 for i in data_num_packets]),
             color="#AC9820",
             label="Data",
         )
@@ -115,7 +199,7 @@ class PacketsHistogramThroughput:
         ax1.legend(loc="upper right")
 
         # Second plot
-        ax2.plot(np.arange(num_durations), throughput, color="r", linestyle="-")
+        ax2.plot(*self.line(np.arange(num_durations), throughput), color="r", linestyle="-")
         ax2.xaxis.set_major_formatter(xformatter)
         ax2.set_xlabel("Timestamp [UTC]")
         ax2.set_ylabel("Throughput [Mbps]")
@@ -127,12 +211,7 @@ class PacketsHistogramThroughput:
         ax2.spines["top"].set_visible(False)
         plt.tight_layout()
 
-        if self.output:
-            filename = PurePath(self.output).with_suffix(".pdf")
-            fig.savefig(filename, bbox_inches="tight", dpi=300)
-            LOGGER.info(f"Histogram saved to {filename}")
-        else:
-            plt.show()
+        self.save(fig, "Histogram")
 
 
 if __name__ == "__main__":
@@ -141,17 +220,46 @@ if __name__ == "__main__":
         prog="python -m tools.plots.components_hexbin",
     )
 
+    add_common_args(parser, binning=True)
+    parser.add_argument(
+        "--since",
+        type=parse_time,
+        metavar="TIME",
+        help="Only plot packets from TIME, an ISO date in UTC or a duration before now such as "
+        "24h",
+    )
+    parser.add_argument(
+        "--until",
+        type=parse_time,
+        metavar="TIME",
+        help="Only plot packets before TIME, an ISO date in UTC or a duration before now",
+    )
     parser.add_argument(
-        "--duration",
-        default=60,
+        "--follow",
+        nargs="?",
+        const=60,
+        type=float,
+        metavar="SECONDS",
+        help="Keep the bins and redraw with the new packets every SECONDS (default: 60)",
+    )
+    parser.add_argument(
+        "--max-vertices",
+        nargs="?",
+        const=MAX_VERTICES,
         type=int,
-        help="Duration in minutes to group packets (default: 60)",
+        metavar="N",
+        help="Decimate each series to about N vertices, keeping the peaks "
+        f"(default: {MAX_VERTICES})",
     )
-    parser.add_argument("-o", "--output", metavar="FILE", type=str, help="Save to file.")
     args = parser.parse_args()
+    check_common_args(parser, args)
+    if args.dbs and args.follow:
+        parser.error("--follow reads a single database, it cannot be used with --dbs")
+    if args.export and args.follow:
+        parser.error("--follow redraws the plot, it cannot be used with --export")
 
     plot = PacketsHistogramThroughput(
-        DB,
+        settings.DB,
         {
             "INTEREST": MONGO_COLLECTION_INTEREST,
             "DATA": MONGO_COLLECTION_DATA,
@@ -160,5 +268,17 @@ if __name__ == "__main__":
         },
     )
 
-    plot.output = args.output
-    asyncio.run(plot.plot(args.duration))
+    apply_common_args(plot, args)
+    plot.duration = args.duration
+    plot.since = args.since
+    plot.until = args.until
+    plot.max_vertices = args.max_vertices
+
+    async def main():
+        plot.source = await open_source(args)
+        await plot.plot(args.export)
+
+    if args.follow:
+        asyncio.run(plot.follow(args.duration, args.follow))
+    else:
+        asyncio.run(main())
@@ -0,0 +1,72 @@
+import numpy as np
+
+# Vertices kept per series by default, more than the device pixels across a figure printed at
+# 300 dpi
+MAX_VERTICES = 4000
+
+
+def decimate(x, y, max_vertices=MAX_VERTICES):
+    # Min/max decimation of a line: the points are split into max_vertices / 2 runs of consecutive
+    # points and each run keeps its lowest and highest point in their order, so peaks survive
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(y) <= max_vertices:
+        return x, y
+    runs = max(max_vertices // 2, 1)
+    run = np.arange(len(y)) * runs // len(y)
+    # Sorted by run then by value: the first point of a run is its minimum, the last its maximum
+    order = np.lexsort((y, run))
+    starts = np.flatnonzero(np.r_[True, run[order][1:] != run[order][:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    keep = np.unique(np.concatenate((order[starts], order[ends], [0, len(y) - 1])))
+    return x[keep], y[keep]
+
+
+def compact_steps(x, y):
+    # Drops the vertices inside runs of equal x or equal y, which lie on the segment between the
+    # ends of their run when the curve is monotone, such as a CDF with one vertex per sample
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 2:
+        return x, y
+    inner_x = (x[1:-1] == x[:-2]) & (x[1:-1] == x[2:])
+    inner_y = (y[1:-1] == y[:-2]) & (y[1:-1] == y[2:])
+    keep = np.r_[True, ~(inner_x | inner_y), True]
+    return x[keep], y[keep]
+
+
+def bound_steps(x, y, max_vertices=MAX_VERTICES):
+    # Compacts a monotone step curve, then keeps the first and last vertex of each 1 / (max_vertices
+    # / 2) slice of its height. The curve moves by less than a slice between two kept vertices,
+    # and jumps larger than a slice keep both their ends.
+    x, y = compact_steps(x, y)
+    if len(y) <= max_vertices:
+        return x, y
+    slices = max(max_vertices // 2 - 1, 1)
+    height = y[-1] - y[0]
+    bucket = np.floor((y - y[0]) / height * slices) if height else np.zeros(len(y))
+    changes = bucket[1:] != bucket[:-1]
+    keep = np.r_[True, changes] | np.r_[changes, True]
+    return x[keep], y[keep]
+
+
+def density_mesh(x, y, weights=None, bins=1024):
+    # Pre-bins points for a density plot (hexbin with C= and a sum). Returns the centers and the
+    # total weight of the non-empty cells of a mesh of at most bins x bins cells. Integer points
+    # with ranges below bins are kept exactly, one cell per distinct point.
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if not len(x):
+        return x, y, np.array([])
+    integers = np.issubdtype(x.dtype, np.integer) and np.issubdtype(y.dtype, np.integer)
+    if integers and np.ptp(x) < bins and np.ptp(y) < bins:
+        x0, y0 = x.min(), y.min()
+        cols = int(np.ptp(y)) + 1
+        counts = np.bincount((x - x0) * cols + (y - y0), weights=weights)
+        cells = np.flatnonzero(counts)
+        return cells // cols + x0, cells % cols + y0, counts[cells]
+    counts, x_edges, y_edges = np.histogram2d(x, y, bins=bins, weights=weights)
+    i, j = np.nonzero(counts)
+    x_centers = (x_edges[:-1] + x_edges[1:]) / 2
+    y_centers = (y_edges[:-1] + y_edges[1:]) / 2
+    return x_centers[i], y_centers[j], counts[i, j]
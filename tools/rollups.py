@@ -0,0 +1,194 @@
+import math
+from collections import Counter
+from datetime import timedelta
+
+import numpy as np
+
+from settings import LOGGER, MONGO_COLLECTION_ROLLUPS
+from tools.binning import EPOCH, ThroughputBinner, num_bins, to_datetime
+from tools.names import PREFIX_LEVELS, name_prefixes
+
+# Per-minute packets and bytes, counts of a few packet fields and per-level prefix counts, each
+# keyed by the packet collection (c) they summarize
+THROUGHPUT = f"{MONGO_COLLECTION_ROLLUPS}-throughput"
+VALUES = f"{MONGO_COLLECTION_ROLLUPS}-values"
+PREFIXES = f"{MONGO_COLLECTION_ROLLUPS}-prefixes"
+
+VALUE_FIELDS = ("hopLimit", "lifetime", "freshness")
+NS_PER_MINUTE = 60 * 10**9
+
+
+def ts_minute(ts):
+    # Minute of the timestamp, rounded to microseconds first like datetime.utcfromtimestamp
+    seconds = ts / 1e9
+    whole = math.floor(seconds)
+    return (whole * 1000000 + round((seconds - whole) * 1e6)) // 60000000
+
+
+# Rollup increments of the packets parsed since the last flush
+class RollupCounts:
+    def __init__(self):
+        self.throughput = {}
+        self.values = Counter()
+        self.prefixes = Counter()
+
+    def add(self, collection, packet):
+        ts = packet.get("ts")
+        minute = None if ts is None else ts_minute(ts)
+        counts = self.throughput.setdefault((collection, minute), [0, 0])
+        counts[0] += 1
+        counts[1] += packet.get("size2") or 0
+        for field in VALUE_FIELDS:
+            self.values[collection, field, packet.get(field)] += 1
+        name = packet.get("name")
+        if name is not None:
+            prefixes = packet.get("prefixes") or name_prefixes(name)
+            for level, prefix in enumerate(prefixes, start=1):
+                self.prefixes[collection, level, prefix] += 1
+
+    def merge(self, other):
+        for key, (packets, size) in other.throughput.items():
+            counts = self.throughput.setdefault(key, [0, 0])
+            counts[0] += packets
+            counts[1] += size
+        self.values.update(other.values)
+        self.prefixes.update(other.prefixes)
+
+    def __len__(self):
+        return len(self.throughput)
+
+
+# pymongo is imported by the functions that use it: the plots import this module at startup, before
+# they connect to the database
+async def create_rollup_indexes(db):
+    from pymongo import ASCENDING, DESCENDING
+
+    await db[THROUGHPUT].create_index([("c", ASCENDING), ("minute", ASCENDING)], unique=True)
+    await db[VALUES].create_index(
+        [("c", ASCENDING), ("field", ASCENDING), ("value", ASCENDING)], unique=True
+    )
+    await db[PREFIXES].create_index(
+        [("c", ASCENDING), ("level", ASCENDING), ("prefix", ASCENDING)], unique=True
+    )
+    await db[PREFIXES].create_index(
+        [("c", ASCENDING), ("level", ASCENDING), ("count", DESCENDING), ("prefix", ASCENDING)]
+    )
+
+
+async def write_rollups(db, counts):
+    # One unordered bulk of $inc upserts per rollup collection
+    from pymongo import UpdateOne
+
+    writes = {
+        THROUGHPUT: [
+            UpdateOne(
+                {"c": c, "minute": minute},
+                {"$inc": {"packets": packets, "bytes": size}},
+                upsert=True,
+            )
+            for (c, minute), (packets, size) in counts.throughput.items()
+        ],
+        VALUES: [
+            UpdateOne({"c": c, "field": field, "value": value}, {"$inc": {"count": n}}, upsert=True)
+            for (c, field, value), n in counts.values.items()
+        ],
+        PREFIXES: [
+            UpdateOne(
+                {"c": c, "level": level, "prefix": prefix}, {"$inc": {"count": n}}, upsert=True
+            )
+            for (c, level, prefix), n in counts.prefixes.items()
+        ],
+    }
+    for collection, requests in writes.items():
+        if requests:
+            await db[collection].bulk_write(requests, ordered=False)
+
+
+async def covers(db, collection):
+    # The rollups are only used when they count every document of the collection
+    pipeline = [
+        {"$match": {"c": collection}},
+        {"$group": {"_id": None, "packets": {"$sum": "$packets"}}},
+    ]
+    packets = 0
+    async for row in db[THROUGHPUT].aggregate(pipeline):
+        packets = row["packets"]
+    return packets == await db[collection].estimated_document_count()
+
+
+async def rollup_throughput(db, collections, duration, since=None, until=None):
+    # The bins of aggregate_throughput anchored on whole minutes, None when the rollups do not
+    # cover the collections. The rollups count whole minutes, so the start of the bins is floored
+    # to the minute and since/until are rounded out to minutes.
+    for collection in collections.values():
+        if not await covers(db, collection):
+            return None
+
+    minutes = {"$ne": None}
+    if since is not None:
+        minutes["$gte"] = since // NS_PER_MINUTE
+    if until is not None:
+        minutes["$lt"] = -(-until // NS_PER_MINUTE)
+    rows = {name: [] for name in collections}
+    names = {collection: name for name, collection in collections.items()}
+    query = {"c": {"$in": list(names)}, "minute": minutes}
+    async for row in db[THROUGHPUT].find(query, {"_id": 0}):
+        rows[names[row["c"]]].append(row)
+
+    first = [min(row["minute"] for row in rows[n]) for n in ("INTEREST", "DATA") if rows[n]]
+    last = [max(row["minute"] for row in rows[n]) for n in ("INTEREST", "DATA") if rows[n]]
+    if not first:
+        raise ValueError("No interest or data packets found.")
+    first_minute = min(first) if since is None else since // NS_PER_MINUTE
+    start_time = EPOCH + timedelta(minutes=first_minute)
+    if until is None:
+        end_time = EPOCH + timedelta(minutes=max(last))
+    else:
+        # Like range_binner, which ends on until - 1 rounded to microseconds
+        end_time = to_datetime(-(-until // NS_PER_MINUTE) * NS_PER_MINUTE - 1)
+    if since is None and until is None:
+        num_durations = num_bins(start_time, end_time, duration)
+    else:
+        num_durations = num_bins(start_time, end_time, duration, max_minutes=None)
+
+    if (since is not None and since % NS_PER_MINUTE) or (
+        until is not None and until % NS_PER_MINUTE
+    ):
+        LOGGER.info("The rollups count whole minutes, since and until are rounded out to minutes.")
+    LOGGER.info(f"Rollup bins start on the whole minute {start_time}.")
+    binner = ThroughputBinner(start_time, duration, num_durations)
+    for name, collection_rows in rows.items():
+        if collection_rows:
+            binner.add(
+                name,
+                np.array([row["minute"] for row in collection_rows]) * NS_PER_MINUTE,
+                np.array([row["bytes"] for row in collection_rows]),
+                counts=np.array([row["packets"] for row in collection_rows]),
+            )
+    return binner.result()
+
+
+async def rollup_values(db, collection, field):
+    # Value -> count of a field, with None for the documents without it
+    if not await covers(db, collection):
+        return None
+    cursor = db[VALUES].find({"c": collection, "field": field}, {"_id": 0})
+    return {row["value"]: row["count"] async for row in cursor}
+
+
+async def rollup_top_prefixes(db, collection, n):
+    from pymongo import ASCENDING, DESCENDING
+
+    if not await covers(db, collection):
+        return None
+    top_prefixes = {}
+    for level in range(1, PREFIX_LEVELS + 1):
+        cursor = (
+            db[PREFIXES]
+            .find({"c": collection, "level": level}, {"_id": 0})
+            .sort([("count", DESCENDING), ("prefix", ASCENDING)])
+            .limit(n)
+        )
+        if rows := [(row["prefix"], row["count"]) async for row in cursor]:
+            top_prefixes[level] = rows
+    return top_prefixes
@@ -0,0 +1,89 @@
+import heapq
+import math
+from collections import Counter
+
+import numpy as np
+
+
+# Space-Saving heavy hitters (Metwally et al.): at most `capacity` items are monitored, and the
+# count of a monitored item overestimates its true count by at most total / capacity.
+class SpaceSaving:
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.counts = {}
+        self.errors = {}
+        # One entry per monitored item, whose count may lag behind the real one
+        self.heap = []
+
+    @classmethod
+    def from_error(cls, error):
+        return cls(math.ceil(1 / error))
+
+    def add(self, item, count=1):
+        self.total += count
+        if item in self.counts:
+            self.counts[item] += count
+        elif len(self.counts) < self.capacity:
+            self.counts[item] = count
+            self.errors[item] = 0
+            heapq.heappush(self.heap, (count, item))
+        else:
+            # Refresh stale entries until the top of the heap is the true minimum
+            while self.heap[0][0] != self.counts[self.heap[0][1]]:
+                heapq.heapreplace(self.heap, (self.counts[self.heap[0][1]], self.heap[0][1]))
+            min_count, victim = self.heap[0]
+            del self.counts[victim]
+            del self.errors[victim]
+            self.counts[item] = min_count + count
+            self.errors[item] = min_count
+            heapq.heapreplace(self.heap, (self.counts[item], item))
+
+    def update(self, items):
+        # Same as Counter.update with an iterable: every item counts once
+        for item in items:
+            self.add(item)
+
+    def most_common(self, n=None):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+    def error(self, item):
+        return self.errors.get(item, 0)
+
+    @property
+    def error_bound(self):
+        return self.total / self.capacity
+
+    def __len__(self):
+        return len(self.counts)
+
+
+# Exact distribution of heavily repeated values: memory grows with the number of distinct values
+# instead of the number of samples
+class ValueCounts:
+    def __init__(self):
+        self.counts = Counter()
+
+    def update(self, values):
+        values, counts = np.unique(values, return_counts=True)
+        self.counts.update(dict(zip(values.tolist(), counts.tolist())))
+
+    def arrays(self):
+        # Sorted distinct values and their counts
+        values = np.array(sorted(self.counts))
+        counts = np.array([self.counts[value] for value in values.tolist()], dtype=np.int64)
+        return values, counts
+
+    def cdf(self):
+        # Two vertices per distinct value, where the CDF of the sorted samples enters and leaves
+        # it, so the step curve matches the one drawn with one vertex per sample
+        if not self.counts:
+            return np.array([]), np.array([])
+        values, counts = self.arrays()
+        total = counts.sum()
+        ends = np.cumsum(counts)
+        starts = ends - counts + 1
+        return np.repeat(values, 2), np.column_stack((starts, ends)).ravel() / total
+
+    def __len__(self):
+        return sum(self.counts.values())
@@ -0,0 +1,295 @@
+import asyncio
+import re
+from datetime import datetime
+from fnmatch import fnmatch
+
+from settings import LOGGER
+from tools.binning import aggregate_bins, range_binner, ts_bounds, ts_range
+
+# Site databases are named <site>-<day>T<time>Z, e.g. wundngw-2023-06-06T05:00:13Z
+DATABASE_NAME = re.compile(r"(?P<site>.+)-(?P<day>\d{4}-\d{2}-\d{2})(T.*)?")
+
+# Stages after which the rows of several databases cannot simply be concatenated
+BLOCKING_STAGES = {"$group", "$facet", "$count", "$bucket", "$bucketAuto", "$sortByCount"}
+FINAL_STAGES = {"$sort", "$limit"}
+
+
+def _merge_min(a, b):
+    # Like $min, null values are ignored
+    return b if a is None else a if b is None else min(a, b)
+
+
+def _merge_max(a, b):
+    return b if a is None else a if b is None else max(a, b)
+
+
+# How the partial results of each $group accumulator combine
+ACCUMULATORS = {
+    "$sum": lambda a, b: (a or 0) + (b or 0),
+    "$min": _merge_min,
+    "$max": _merge_max,
+}
+
+
+def parse_database(name):
+    # (site, day) of a site database name, (name, None) for other databases
+    if match := DATABASE_NAME.fullmatch(name):
+        return match["site"], match["day"]
+    return name, None
+
+
+async def site_databases(client, patterns):
+    # Database names matching the patterns (fnmatch globs), in the order of the patterns
+    names = sorted(await client.list_database_names())
+    dbs = []
+    for pattern in patterns:
+        matches = [name for name in names if fnmatch(name, pattern)]
+        if not matches:
+            LOGGER.warning(f"No database matches {pattern}")
+        dbs += [name for name in matches if name not in dbs]
+    return dbs
+
+
+def _group_key(value):
+    # Documents and arrays are not hashable, they are compared through their BSON encoding
+    if isinstance(value, dict | list):
+        import bson
+
+        return bson.encode({"_id": value})
+    return value
+
+
+def group_merges(group):
+    # Merge function of each accumulated field of a $group stage
+    merges = {}
+    for field, accumulator in group.items():
+        if field == "_id":
+            continue
+        (operator,) = accumulator
+        if operator not in ACCUMULATORS:
+            raise ValueError(f"{operator} results cannot be merged across databases")
+        merges[field] = ACCUMULATORS[operator]
+    return merges
+
+
+class GroupMerge:
+    # Combines the rows that several databases return for the same $group stage, as they arrive
+    def __init__(self, group):
+        self.merges = group_merges(group)
+        self.rows = {}
+
+    def add(self, row):
+        key = _group_key(row["_id"])
+        if key not in self.rows:
+            self.rows[key] = dict(row)
+            return
+        merged = self.rows[key]
+        for field, merge in self.merges.items():
+            merged[field] = merge(merged.get(field), row.get(field))
+
+    def result(self):
+        return list(self.rows.values())
+
+
+def merge_groups(group, partials):
+    merge = GroupMerge(group)
+    for partial in partials:
+        for row in partial:
+            merge.add(row)
+    return merge.result()
+
+
+def _sort_key(value):
+    # Orders values of different types like MongoDB does, nulls and missing fields first. Arrays
+    # are compared element by element.
+    if value is None:
+        return (0,)
+    if isinstance(value, bool):
+        return (7, value)
+    if isinstance(value, int | float):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, dict):
+        return (3, [(key, _sort_key(item)) for key, item in value.items()])
+    if isinstance(value, list):
+        return (4, [_sort_key(item) for item in value])
+    if isinstance(value, bytes):
+        return (5, value)
+    from bson import ObjectId
+
+    if isinstance(value, ObjectId):
+        return (6, value.binary)
+    if isinstance(value, datetime):
+        return (8, value)
+    return (9, repr(value))
+
+
+def apply_final_stages(rows, stages):
+    # $sort and $limit on merged rows
+    for stage in stages:
+        if "$sort" in stage:
+            # Stable sorts from the last key to the first
+            for field, direction in reversed(stage["$sort"].items()):
+                rows = sorted(
+                    rows, key=lambda row: _sort_key(row.get(field)), reverse=direction < 0
+                )
+        else:
+            rows = rows[: stage["$limit"]]
+    return rows
+
+
+def split_pipeline(pipeline):
+    # The stages each database runs and the trailing $sort and $limit, which are re-applied after
+    # the merge since the top rows of each database are not enough after a $group
+    end = len(pipeline)
+    while end and next(iter(pipeline[end - 1])) in FINAL_STAGES:
+        end -= 1
+    stages, final = pipeline[:end], pipeline[end:]
+    for stage in stages[:-1]:
+        if next(iter(stage)) in BLOCKING_STAGES:
+            raise ValueError(f"{next(iter(stage))} must be the last stage to merge its results")
+    last = next(iter(stages[-1])) if stages else None
+    if last == "$group":
+        group_merges(stages[-1]["$group"])
+    elif last == "$facet":
+        for facet in stages[-1]["$facet"].values():
+            split_pipeline(facet)
+    elif last in BLOCKING_STAGES:
+        raise ValueError(f"{last} results cannot be merged across databases")
+    return stages, final
+
+
+def overfetch_stages(group, final, overfetch):
+    # Per-database $sort and $limit keeping `overfetch` times the rows of the final $limit, when
+    # the final $sort is by a $sum of the group in descending order, None otherwise
+    if not overfetch or len(final) != 2 or "$sort" not in final[0] or "$limit" not in final[1]:
+        return None
+    field, direction = next(iter(final[0]["$sort"].items()))
+    if direction >= 0 or next(iter(group.get(field, {None: None}))) != "$sum":
+        return None
+    return [final[0], {"$limit": final[1]["$limit"] * overfetch}], field
+
+
+# A set of (site, day) databases with the same collections. Aggregations are run on every
+# database through the shared client, at most `concurrency` at a time, and their partial results
+# are merged before they reach the plots.
+class DataSource:
+    def __init__(self, client, databases, concurrency=4, slots=None):
+        self.client = client
+        self.databases = list(databases)
+        # Multiple of the final $limit of a top-N $group that each database returns, None reads
+        # every group and the merge is exact (see aggregate_groups)
+        self.overfetch = None
+        # Shared with the sources split from this one, so that the limit holds over all of them
+        self.slots = slots or asyncio.Semaphore(concurrency)
+
+    @classmethod
+    async def matching(cls, client, patterns, concurrency=4):
+        return cls(client, await site_databases(client, patterns), concurrency)
+
+    def __len__(self):
+        return len(self.databases)
+
+    def by_site(self):
+        # One source per site with its databases of every day
+        sites = {}
+        for name in self.databases:
+            site, _ = parse_database(name)
+            sites.setdefault(site, []).append(name)
+        return {
+            site: DataSource(self.client, names, slots=self.slots) for site, names in sites.items()
+        }
+
+    async def map(self, function):
+        # Results of function(db) for every database, in the order of the databases
+        async def run(name):
+            async with self.slots:
+                return await function(self.client[name])
+
+        return await asyncio.gather(*(run(name) for name in self.databases))
+
+    async def aggregate(self, collection, pipeline, **kwargs):
+        stages, final = split_pipeline(pipeline)
+        last = next(iter(stages[-1])) if stages else None
+
+        if last == "$facet":
+            # Each facet runs as its own pipeline: inside a $facet, the groups of a database would
+            # all have to fit in a single 16 MB document
+            facets = stages[-1]["$facet"]
+            results = await asyncio.gather(
+                *(
+                    self.aggregate(collection, [*stages[:-1], *facet], **kwargs)
+                    for facet in facets.values()
+                )
+            )
+            return apply_final_stages([dict(zip(facets, results))], final)
+
+        if last == "$group":
+            return apply_final_stages(
+                await self.aggregate_groups(collection, stages, final, **kwargs), final
+            )
+
+        # Plain rows: the top rows of each database contain the top rows of all of them
+        async def rows(db):
+            return [row async for row in db[collection].aggregate(pipeline, **kwargs)]
+
+        partials = await self.map(rows)
+        return apply_final_stages([row for rows in partials for row in rows], final)
+
+    async def aggregate_groups(self, collection, stages, final, **kwargs):
+        # The groups of every database merged as their cursors are read. With self.overfetch,
+        # each database only returns its overfetch x $limit top groups. A group cut from the
+        # rows of a database is then undercounted by at most the smallest count that database
+        # returned, and the sum of these counts over the databases bounds the error of every
+        # merged count, which is logged.
+        group = stages[-1]["$group"]
+        merge = GroupMerge(group)
+        overfetch = overfetch_stages(group, final, self.overfetch)
+        partial = stages + overfetch[0] if overfetch else stages
+        bounds = []
+
+        async def add_rows(db):
+            count = 0
+            last = None
+            async for row in db[collection].aggregate(partial, **kwargs):
+                merge.add(row)
+                count += 1
+                last = row
+            if overfetch and count == overfetch[0][1]["$limit"]:
+                bounds.append(last.get(overfetch[1]) or 0)
+
+        await self.map(add_rows)
+        if bounds:
+            LOGGER.info(
+                f"{len(bounds)} databases returned only their top "
+                f"{overfetch[0][1]['$limit']} groups of {collection}: each merged "
+                f"{overfetch[1]} is low by at most {sum(bounds)}"
+            )
+        return merge.result()
+
+    async def ts_range(self, collections, bounds=None):
+        async def db_range(db):
+            try:
+                return await ts_range(db, collections, bounds)
+            except ValueError:
+                return None
+
+        ranges = [found for found in await self.map(db_range) if found is not None]
+        if not ranges:
+            raise ValueError("No interest or data packets found.")
+        return min(first for first, _ in ranges), max(last for _, last in ranges)
+
+    async def throughput(self, collections, duration, since=None, until=None, max_minutes=None):
+        # The server-side bins of every database added to a single binner. By default the whole
+        # range is binned, since several days do not fit in MAX_MINUTES.
+        bounds = ts_bounds(since, until)
+        first_ts, last_ts = await self.ts_range(collections, bounds)
+        binner = range_binner(first_ts, last_ts, duration, since, until, max_minutes)
+
+        async def add_bins(db):
+            for name, collection in collections.items():
+                await aggregate_bins(binner, db, name, collection, bounds)
+
+        await self.map(add_bins)
+        return binner.result()